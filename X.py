@@ -1,229 +1,932 @@
+import os
+import sys
+import time
+from dataclasses import dataclass
+from typing import Optional
+
 import pandas as pd
 
 import numpy as np # Imported for rounding calculations
+from openpyxl import load_workbook
+
+from input_cache import HAVE_PYARROW, default_cache
+from forecast import daily_sales_matrix, forecast_week_sales
+from history import record_run
+from irc_index import IrcIndex
+from metrics import StageTimer, configure_logging, profiled
+from report_writer import ReportWriter
+from rules import FILTER_RULES, default_rules
+from sales_rollup import ROLLUP_COLUMNS, rollup_sales, trailing_window
+
+
+def insert_department_separators(df_sorted):
+    """
+    Returns (df_final, separator_positions) where df_final is df_sorted with a
+    blank row inserted wherever the Department changes, and separator_positions
+    are the 0-based row positions of those blank rows within df_final.
+    """
+    departments = df_sorted['Department'].to_numpy()
+
+    # Positions (in df_sorted) where a new department starts, excluding the first row
+    breaks = np.flatnonzero(departments[1:] != departments[:-1]) + 1
+    if len(breaks) == 0:
+        return df_sorted, breaks
+
+    n_rows = len(df_sorted)
+    n_total = n_rows + len(breaks)
+
+    # Every data row is shifted down by the number of separators that precede it
+    data_positions = np.arange(n_rows) + np.searchsorted(breaks, np.arange(n_rows), side='right')
+    separator_positions = breaks + np.arange(len(breaks))
+
+    values = np.full((n_total, len(df_sorted.columns)), '', dtype=object)
+    values[data_positions] = df_sorted.to_numpy(dtype=object)
+
+    df_final = pd.DataFrame(values, columns=df_sorted.columns)
+    return df_final, separator_positions
+
 
 def style_and_write_sheet(df, writer, sheet_name):
     """
     Injects black separator rows between departments, styles them,
-    and writes the result to a sheet in an ExcelWriter object.
+    and writes the result to a sheet in a ReportWriter.
     """
     # Ensure the dataframe is sorted by Department to group them correctly
     df_sorted = df.sort_values(by='Department')
 
-    data_with_separators = []
-    last_dept = None
-    # Create a blank row that will be styled black
-    separator_row = {col: '' for col in df_sorted.columns}
-
-    for index, row in df_sorted.iterrows():
-        current_dept = row['Department']
-        # Add a separator if the department has changed (and it's not the first row)
-        if last_dept is not None and current_dept != last_dept:
-            data_with_separators.append(separator_row)
-        data_with_separators.append(row.to_dict())
-        last_dept = current_dept
-
     # If there's no data, don't create the sheet
-    if not data_with_separators:
+    if df_sorted.empty:
         return
 
-    df_final = pd.DataFrame(data_with_separators)
-
-    # Define the styling function
-    def black_separator_styler(row):
-        # If all cells in the row are empty, color the background black
-        if all(cell == '' for cell in row):
-            return ['background-color: black'] * len(row)
-        else:
-            return [''] * len(row)
-
-    # Apply the style and write to the specified Excel sheet
-    df_final.style.apply(black_separator_styler, axis=1).to_excel(
-        writer, sheet_name=sheet_name, index=False
-    )
+    df_final, separator_positions = insert_department_separators(df_sorted)
+    writer.write_sheet(df_final, sheet_name, separator_positions)
 
 #NEW FUNCTION 1
 
 def write_plain_sheet(df, writer, sheet_name):
     if df.empty:
         return
-    df.to_excel(writer, sheet_name=sheet_name, index=False)
-#----------------------------------------------------------------------------------------------------------------------------
+    writer.write_sheet(df, sheet_name)
 
-def calculate_reorder_quantities(
-    sales_file='sales.xlsx',
-    inventory_file='inventory.xlsx',
-    ignore_file='ignore.xlsx',
-    irc_file='IRC.xlsx',
-    auto_export=False
-):
 
+# --- Input Loaders ---
+# Each reader parses one input file into a normalized frame, so the result
+# can be cached and reused as long as the file contents do not change.
+# Every reader accepts .xlsx, .csv and .parquet files (see read_table).
 
+# File extensions understood by read_table, and the format each one means
+INPUT_EXTENSIONS = {
+    '.xlsx': 'xlsx', '.xlsm': 'xlsx', '.xls': 'xlsx',
+    '.csv': 'csv', '.txt': 'csv',
+    '.parquet': 'parquet', '.pq': 'parquet',
+}
+
+# Rows per chunk when streaming a CSV sales export
+SALES_CSV_CHUNK_ROWS = int(os.environ.get('ORDERGEN_CSV_CHUNK_ROWS', '200000'))
+
+
+def input_format(source):
     """
-    Analyzes sales data and current inventory to calculate re-order quantities.
+    Returns 'xlsx', 'csv' or 'parquet' for a file path or binary file-like
+    object. Paths are judged by their extension; file-like objects and
+    unknown extensions by their first bytes.
     """
-    try:
-        # --- Define Departments with Special 1-Week Supply Rule ---
-        special_departments = [
-            'BAKERY (WALL)- SHORT SHELF LIFE (BELOW 14 DAYS)',
-            'BAKERY - COOLER',
-            'BAKERY-SHORT SHELF LIFE (BELOW 14 DAYS)',
-            'COOLER - CHEESE / BUTTER',
-            'COOLER - DESSERT',
-            'COOLER - DIP',
-            'COOLER - MEAT',
-            'COOLER - READY TO USE / EAT / DRINK',
-            'YOGURT/YOGURT DRINK',
-            'MILK'
-        ]
-        # Create a lowercase version for case-insensitive matching
-        special_departments_lower = [d.lower() for d in special_departments]
+    if hasattr(source, 'read'):
+        position = source.tell()
+        head = source.read(4)
+        source.seek(position)
+    else:
+        extension = os.path.splitext(os.fspath(source))[1].lower()
+        if extension in INPUT_EXTENSIONS:
+            return INPUT_EXTENSIONS[extension]
+        try:
+            with open(source, 'rb') as fh:
+                head = fh.read(4)
+        except OSError:
+            return 'xlsx'  # let the reader report the missing file
 
+    if head.startswith(b'PAR1'):
+        return 'parquet'
+    if head.startswith(b'PK') or head.startswith(b'\xd0\xcf\x11\xe0'):  # zip (xlsx) or legacy xls
+        return 'xlsx'
+    return 'csv'
 
-        # --- Load Ignore List (Optional) ---
-        try:
-            df_ignore = pd.read_excel(ignore_file)
-            ignore_codes = set(df_ignore['Stock Code'].astype(str))
-            print(f"Info: Successfully loaded {len(ignore_codes)} stock codes from '{ignore_file}'.")
-        except FileNotFoundError:
-            print(f"Info: The ignore file '{ignore_file}' was not found.")
-            ignore_codes = set()
 
-        # --- Load and Process Inventory Data ---
+def _csv_text_dtypes(source, text_columns=()):
+    """
+    read_csv dtypes that keep stock codes as text: any 'Stock Code' column
+    plus the columns at the text_columns positions. Otherwise pandas guesses
+    per chunk, dropping leading zeros and keying one SKU two ways.
+    """
+    header = read_header(source) or []
+    dtype = {column: str for column in header if column.lower() == 'stock code'}
+    dtype.update({header[position]: str for position in text_columns if position < len(header)})
+    return dtype
+
+
+def read_table(source, usecols=None, parse_dates=None, text_columns=()):
+    """
+    Reads the first sheet of an Excel workbook, a CSV file or a Parquet file
+    into a DataFrame. usecols is a callable taking a column name.
+    parse_dates lists column positions holding dates, and text_columns
+    positions holding codes (see _csv_text_dtypes); both only matter for
+    CSV, since Excel and Parquet files carry typed values already.
+    """
+    file_format = input_format(source)
+    if file_format == 'csv':
+        df = pd.read_csv(source, usecols=usecols, dtype=_csv_text_dtypes(source, text_columns))
+        for position in parse_dates or ():
+            if position < len(df.columns):
+                column = df.columns[position]
+                df[column] = pd.to_datetime(df[column], errors='coerce')
+        return df
+    if file_format == 'parquet':
+        df = pd.read_parquet(source)
+        return df if usecols is None else df[[c for c in df.columns if usecols(c)]]
+    return pd.read_excel(source, usecols=usecols)
+
+
+def read_ignore_file(ignore_file):
+    df_ignore = read_table(ignore_file)
+    return pd.DataFrame({'Stock Code': df_ignore['Stock Code'].astype(str)})
+
+
+def read_inventory_file(inventory_file):
+    df_inventory = read_table(inventory_file)
+    df_inventory['Stock Code'] = df_inventory['Stock Code'].astype(str)
+
+    # Handle both "inventory.xlsx" and "stock analysis.xlsx"
+    cols_lower = {c.lower(): c for c in df_inventory.columns}
+
+    if 'quantity' in cols_lower:
+        qty_col = cols_lower['quantity']          # inventory.xlsx
+    elif 'qty. closing' in cols_lower:
+        qty_col = cols_lower['qty. closing']      # stock analysis.xlsx
+    else:
+        raise KeyError("Could not find 'Quantity' or 'Qty. Closing' column in inventory file")
+
+    return pd.DataFrame({
+        'Stock Code': df_inventory['Stock Code'],
+        'Quantity': df_inventory[qty_col].clip(lower=0),
+        # Extra info for IRC matching: description (col C) and department (col O)
+        'Inv Description': df_inventory.iloc[:, 2],
+        'Inv Department': df_inventory.iloc[:, 14],
+    })
+
+
+# Columns the pipeline uses from the sales file, by lowercase name.
+# Either date column is accepted; 'stock date' wins when both exist.
+SALES_COLUMNS = {
+    'stock date': 'Stock Date',          # sales.xlsx
+    'document date': 'Stock Date',       # sales detail.xlsx
+    'stock code': 'Stock Code',
+    'stock description': 'Stock Description',
+    'description': 'Description',
+    'quantity': 'Quantity',
+}
+
+
+def as_text(series):
+    """
+    Text version of a key column. Categoricals are kept as they are, since
+    their categories are already strings.
+    """
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        return series
+    return series.astype(str)
+
+
+def downcast_quantity(quantity):
+    """
+    Whole-number quantities are stored in the smallest integer type that
+    fits; fractional quantities (weighed items) stay float64 so sums are
+    not rounded.
+    """
+    quantity = pd.to_numeric(quantity, errors='coerce')
+    if quantity.notna().all() and (quantity % 1 == 0).all():
+        return pd.to_numeric(quantity.astype('int64'), downcast='integer')
+    return quantity
+
+
+def frame_memory_mb(df):
+    return df.memory_usage(deep=True).sum() / (1024 * 1024)
+
+
+def normalize_sales_frame(df_sales):
+    """
+    Renames the sales columns to their canonical names and applies the
+    compact dtypes: codes, descriptions and departments become categoricals,
+    Quantity is downcast and 'Stock Date' is parsed.
+    """
+    # Normalize date column so we always have 'Stock Date'
+    cols_lower = {str(c).lower(): c for c in df_sales.columns}
+
+    if 'stock date' in cols_lower:
+        date_col = cols_lower['stock date']          # sales.xlsx
+    elif 'document date' in cols_lower:
+        date_col = cols_lower['document date']       # sales detail.xlsx
+    else:
+        raise KeyError("Could not find 'Stock Date' or 'Document Date' in sales file")
+
+    columns = {date_col: 'Stock Date'}
+    for lower, name in SALES_COLUMNS.items():
+        if name != 'Stock Date' and lower in cols_lower:
+            columns[cols_lower[lower]] = name
+    missing = [name for name in SALES_COLUMNS.values() if name not in columns.values()]
+    if missing:
+        raise KeyError(f"Missing column(s) in sales file: {', '.join(missing)}")
+
+    df_sales = df_sales[list(columns)].rename(columns=columns)
+    return pd.DataFrame({
+        'Stock Date': pd.to_datetime(df_sales['Stock Date']),
+        # Text columns are stored as categoricals: one copy of each distinct value
+        'Stock Code': df_sales['Stock Code'].astype(str).astype('category'),
+        'Stock Description': df_sales['Stock Description'].astype(str).astype('category'),
+        'Description': df_sales['Description'].astype(str).astype('category'),
+        'Quantity': downcast_quantity(df_sales['Quantity']),
+    })
+
+
+def _is_sales_column(name):
+    return str(name).lower() in SALES_COLUMNS
+
+
+def read_sales_file(sales_file):
+    """
+    Loads only the columns the pipeline uses, normalized by
+    normalize_sales_frame, so filtering and grouping run on compact codes.
+    """
+    return normalize_sales_frame(read_table(sales_file, usecols=_is_sales_column))
+
+
+def stream_sales_csv(sales_file, ignore_codes=(), rules=None, chunk_rows=SALES_CSV_CHUNK_ROWS):
+    """
+    Reads a CSV sales export chunk by chunk. Each chunk is filtered with the
+    sales rules and collapsed into per-SKU daily totals before the next one
+    is read, so only the rollup is ever held in memory. Returns
+    (rollup, dropped_rows, line_count, date_span); the rollup can be passed
+    to compute_reorder in place of the raw sales frame, together with
+    date_span, the (first, last) timestamps of the kept sales (None when
+    no rows were kept). The rollup's dates are cut to midnight, so the span
+    is needed to measure the period exactly as for the raw line items.
+    """
+    if rules is None:
+        rules = default_rules()
+
+    dropped_rows = dict.fromkeys(FILTER_RULES, 0)
+    rollups = []
+    line_count = 0
+    first_sale = last_sale = None
+    dtype = _csv_text_dtypes(sales_file)
+    for chunk in pd.read_csv(sales_file, usecols=_is_sales_column, dtype=dtype, chunksize=chunk_rows):
+        chunk = normalize_sales_frame(chunk)
+        line_count += len(chunk)
+        keep, dropped = rules.sales_mask(chunk, ignore_codes)
+        for name, count in dropped.items():
+            dropped_rows[name] += count
+        kept = chunk[keep]
+        dates = pd.to_datetime(kept['Stock Date']).dropna()
+        if len(dates):
+            first_sale = dates.min() if first_sale is None else min(first_sale, dates.min())
+            last_sale = dates.max() if last_sale is None else max(last_sale, dates.max())
+        rollups.append(rollup_sales(kept))
+
+    if not rollups:
+        return pd.DataFrame(columns=ROLLUP_COLUMNS), dropped_rows, 0, None
+    # A SKU-day can span two chunks, so the chunk rollups are rolled up once more
+    rollup = rollup_sales(pd.concat(rollups, ignore_index=True))
+    date_span = (first_sale, last_sale) if first_sale is not None else None
+    return rollup, dropped_rows, line_count, date_span
+
+
+def read_irc_file(irc_file):
+    df_irc_raw = read_table(irc_file, parse_dates=[7, 8], text_columns=[0])
+
+    df_irc = pd.DataFrame({
+        'Stock Code': df_irc_raw.iloc[:, 0].astype(str),  # Column A
+        'DESCRIPTION': df_irc_raw.iloc[:, 1],             # Column B
+        'IRC AMT': df_irc_raw.iloc[:, 3],                 # Column D
+        'START DATE': df_irc_raw.iloc[:, 7],              # Column H
+        'END DATE': df_irc_raw.iloc[:, 8]                 # Column I
+    })
+    return df_irc.dropna(subset=['Stock Code'])
+
+
+# --- Header checks ---
+# Cheap checks on the first row only, so a wrong file can be rejected
+# before it is parsed (the web app runs them on every upload).
+
+def read_header(source):
+    """
+    Column names from the first row of an input file, without parsing the
+    rest. Returns None when the format cannot be peeked at cheaply (legacy
+    .xls, or Parquet without pyarrow). File-like sources are rewound.
+    """
+    try:
+        file_format = input_format(source)
+        if file_format == 'csv':
+            return [str(c) for c in pd.read_csv(source, nrows=0).columns]
+        if file_format == 'parquet':
+            try:
+                import pyarrow.parquet as pq
+            except ImportError:
+                return None
+            return list(pq.read_schema(source).names)
+        try:
+            workbook = load_workbook(source, read_only=True)
+        except Exception:
+            return None  # e.g. legacy .xls; the reader reports real problems
         try:
-            df_inventory = pd.read_excel(inventory_file)
-            df_inventory['Stock Code'] = df_inventory['Stock Code'].astype(str)
+            first_row = next(workbook.worksheets[0].iter_rows(max_row=1, values_only=True), ())
+        finally:
+            workbook.close()
+        return ['' if value is None else str(value) for value in first_row]
+    finally:
+        if hasattr(source, 'seek'):
+            source.seek(0)
 
-            # Handle both "inventory.xlsx" and "stock analysis.xlsx"
-            cols_lower = {c.lower(): c for c in df_inventory.columns}
 
-            if 'quantity' in cols_lower:
-                qty_col = cols_lower['quantity']          # inventory.xlsx
-            elif 'qty. closing' in cols_lower:
-                qty_col = cols_lower['qty. closing']      # stock analysis.xlsx
-            else:
-                raise KeyError("Could not find 'Quantity' or 'Qty. Closing' column in inventory file")
+def header_problem(kind, columns):
+    """
+    Describes what a `kind` file ('sales', 'inventory', 'ignore' or 'irc')
+    with these header columns lacks for its read_*_file reader, or returns
+    None when the header looks right.
+    """
+    lower = {str(c).lower() for c in columns}
+    if kind == 'sales':
+        missing = sorted({name for key, name in SALES_COLUMNS.items() if name != 'Stock Date' and key not in lower})
+        if 'stock date' not in lower and 'document date' not in lower:
+            missing.insert(0, "'Stock Date' or 'Document Date'")
+        if missing:
+            return f"Sales file is missing column(s): {', '.join(missing)}"
+    elif kind == 'inventory':
+        if 'Stock Code' not in columns:
+            return "Inventory file is missing the 'Stock Code' column"
+        if 'quantity' not in lower and 'qty. closing' not in lower:
+            return "Inventory file is missing a 'Quantity' or 'Qty. Closing' column"
+        if len(columns) < 15:
+            return "Inventory file needs at least 15 columns (description in C, department in O)"
+    elif kind == 'ignore':
+        if 'Stock Code' not in columns:
+            return "Ignore file is missing the 'Stock Code' column"
+    elif kind == 'irc':
+        if len(columns) < 9:
+            return "IRC file needs at least 9 columns (code in A through END DATE in I)"
+    return None
+
+
+def validate_input_header(source, kind):
+    """
+    Raises ValueError when the header of `source` cannot be a `kind` file,
+    or when it is a Parquet file and no Parquet engine is installed.
+    """
+    if not HAVE_PYARROW and input_format(source) == 'parquet':
+        raise ValueError("Parquet files need pyarrow, which is not installed; upload .xlsx or .csv instead.")
+    columns = read_header(source)
+    if columns is None:
+        return
+    problem = header_problem(kind, columns)
+    if problem:
+        raise ValueError(problem)
 
-            df_inventory['Quantity'] = df_inventory[qty_col].clip(lower=0)
 
-            # Extra info for IRC matching: description (col C) and department (col O)
-            df_inventory['Inv Description'] = df_inventory.iloc[:, 2]
-            df_inventory['Inv Department'] = df_inventory.iloc[:, 14]
+# Stages passed to the optional progress callback, in the order they run
+PIPELINE_STAGES = ['Loading input files', 'Analyzing sales', 'Writing Excel report']
 
-            # Lookups
-            inventory_lookup = df_inventory.set_index('Stock Code')['Quantity']
-            inv_desc_lookup = df_inventory.set_index('Stock Code')['Inv Description']
-            inv_dept_lookup = df_inventory.set_index('Stock Code')['Inv Department']
 
-            inventory_loaded = True
-        except FileNotFoundError:
-            print(f"Warning: The inventory file '{inventory_file}' was not found. 'On Hand' quantities will be unknown.")
-            inventory_loaded = False
+# Sections of compute_reorder reported to the optional timer callback
+COMPUTE_STAGES = ['filter', 'aggregate', 'merge', 'order', 'irc']
 
 
-        # --- Load and Process Sales Data ---
-        df_sales = pd.read_excel(sales_file)
+def _lap(timer, stage, started, rows=None):
+    """
+    Reports the time since `started` (and the rows the stage produced) for
+    `stage` to `timer` when one is given, and returns the current clock
+    reading for the next stage.
+    """
+    now = time.perf_counter()
+    if timer is not None:
+        timer(stage, now - started, rows)
+    return now
 
-        # Normalize date column so we always have 'Stock Date'
-        cols_lower = {c.lower(): c for c in df_sales.columns}
 
-        if 'stock date' in cols_lower:
-            date_col = cols_lower['stock date']          # sales.xlsx
-        elif 'document date' in cols_lower:
-            date_col = cols_lower['document date']       # sales detail.xlsx
-        else:
-            raise KeyError("Could not find 'Stock Date' or 'Document Date' in sales file")
+def report_progress(progress, stage):
+    if progress is not None:
+        progress(stage)
 
-        df_sales = df_sales.rename(columns={date_col: 'Stock Date'})
 
-        # --- Filtering Rules ---
-        df_sales['Stock Code'] = df_sales['Stock Code'].astype(str)
+def load_input(source, kind, reader, cache=None):
+    """
+    Parses `source` with `reader`, going through `cache` when one is given.
+    """
+    if cache is None:
+        return reader(source)
+    return cache.get_or_load(source, kind, reader)
 
+# Days ahead that count as "starting soon" for IRC promotions
+IRC_UPCOMING_DAYS = int(os.environ.get('ORDERGEN_IRC_UPCOMING_DAYS', '7'))
 
-        if ignore_codes:
-            df_sales = df_sales[~df_sales['Stock Code'].isin(ignore_codes)]
-        
-        departments_to_ignore = ['#OPENITEM', 'LOOSE ITEM', 'ECO FEE ADS', 'DEPOSIT', 'Dempsters Bread']
-        departments_to_ignore_lower = [d.lower() for d in departments_to_ignore]
-        df_sales['Description'] = df_sales['Description'].astype(str)
-        df_filtered = df_sales[~df_sales['Description'].str.lower().isin(departments_to_ignore_lower)]
+# Supply horizons, in weeks, that get a '{weeks} WEEKS SUPPLY' sheet
+DEFAULT_HORIZONS = (1, 2, 3, 4)
 
-        desc_strings_to_ignore = ['MONDOUX', 'GREAT CANADIAN MEAT', 'LOOSE']
-        df_filtered['Stock Description'] = df_filtered['Stock Description'].astype(str)
-        df_filtered = df_filtered[~df_filtered['Stock Description'].str.contains('|'.join(desc_strings_to_ignore), case=False, na=False)]
 
-        df_filtered = df_filtered[~df_filtered['Stock Code'].str.contains('LOOSE', case=False, na=False)]
+def week_sales_column(weeks):
+    return f'{weeks} Week Sales'
 
-        # --- Sales Calculations ---
-        df_filtered['Stock Date'] = pd.to_datetime(df_filtered['Stock Date'])
-        min_date = df_filtered['Stock Date'].min()
-        max_date = df_filtered['Stock Date'].max()
-        time_frame_days = (max_date - min_date).days if (max_date - min_date).days > 0 else 1
 
-        product_sales = df_filtered.groupby(['Stock Code', 'Stock Description', 'Description'])['Quantity'].sum().reset_index()
+def compute_week_sales(avg_daily_sales, horizons):
+    """
+    Returns an (n_skus, n_horizons) array of expected sales per horizon.
+    Figures below 1 are zeroed so they never trigger an order.
+    """
+    days = 7 * np.asarray(horizons, dtype=float)
+    week_sales = np.outer(np.asarray(avg_daily_sales, dtype=float), days)
+    week_sales[week_sales < 1] = 0
+    return week_sales
 
-        product_sales['Avg Daily Sales'] = product_sales['Quantity'] / time_frame_days
-        product_sales['1 Week Sales'] = product_sales['Avg Daily Sales'] * 7
-        product_sales['2 Week Sales'] = product_sales['Avg Daily Sales'] * 14
-        product_sales['3 Week Sales'] = product_sales['Avg Daily Sales'] * 21
-        product_sales['4 Week Sales'] = product_sales['Avg Daily Sales'] * 28
 
-        # --- Ignore weekly sales figures that are less than 1 ---
-        for i in range(1, 5):
-            sales_col = f'{i} Week Sales'
-            product_sales.loc[product_sales[sales_col] < 1, sales_col] = 0
-        # --- Load IRC Data (Optional) ---
-        try:
-            df_irc_raw = pd.read_excel(irc_file)
+def compute_order_matrix(week_sales, on_hand, is_special, special_sales):
+    """
+    Quantity to order for every SKU and horizon in one pass.
 
-            df_irc = pd.DataFrame({
-                'Stock Code': df_irc_raw.iloc[:, 0].astype(str),  # Column A
-                'DESCRIPTION': df_irc_raw.iloc[:, 1],             # Column B
-                'IRC AMT': df_irc_raw.iloc[:, 3],                 # Column D
-                'START DATE': df_irc_raw.iloc[:, 7],              # Column H
-                'END DATE': df_irc_raw.iloc[:, 8]                 # Column I
-            })
+    week_sales: (n_skus, n_horizons) expected sales per horizon.
+    on_hand: (n_skus,) numeric stock on hand, NaN when unknown.
+    is_special: (n_skus,) True for special departments, which always order
+        one week of sales regardless of horizon or stock on hand.
+    special_sales: (n_skus,) the one-week sales used for special departments.
 
+    Returns an (n_skus, n_horizons) float array holding the (rounded up)
+    quantity to order, or NaN where the SKU does not need ordering.
+    """
+    on_hand = np.asarray(on_hand, dtype=float)[:, None]
+    is_special = np.asarray(is_special, dtype=bool)[:, None]
+    special_sales = np.asarray(special_sales, dtype=float)[:, None]
+    on_hand_unknown = np.isnan(on_hand)
 
-            df_irc = df_irc.dropna(subset=['Stock Code'])
+    # Regular departments: order the shortfall when stock does not cover
+    # the horizon (or is unknown) and the horizon sells at least one unit
+    needs_ordering = (on_hand < week_sales) | on_hand_unknown
+    regular_qty = np.where(on_hand_unknown, week_sales, week_sales - on_hand)
+    regular_qty = np.where(needs_ordering & (week_sales >= 1), regular_qty, np.nan)
 
-            irc_lookup_amt = df_irc.set_index('Stock Code')['IRC AMT']
-            irc_lookup_end = df_irc.set_index('Stock Code')['END DATE']
-            irc_loaded = True
+    # Special departments: always one week of sales, stock is ignored
+    special_qty = np.broadcast_to(special_sales, week_sales.shape)
 
-        except:
-            irc_loaded = False
+    qty = np.ceil(np.where(is_special, special_qty, regular_qty))
+    qty[~(qty > 0)] = np.nan
+    return qty
 
 
-        # --- Merge Inventory Data ---
+@dataclass
+class ReorderResult:
+    """
+    Everything computed for one run, ready to print or export.
+
+    product_sales: one row per SKU with sales, On Hand and IRC columns.
+    full_data: the FULL DATA sheet.
+    supply: {weeks: frame} for each non-empty '{weeks} WEEKS SUPPLY' sheet.
+    horizons: the supply horizons in weeks.
+    order_matrix: (n_skus, n_horizons) quantity to order, aligned with
+        product_sales rows and horizons; NaN where nothing is ordered.
+    irc / irc_new: the IRC and IRC NEW ITEMS sheets (None without an IRC list).
+    ordered_codes: stock codes that appear on any supply sheet.
+    dropped_rows: {rule name: sales rows removed by that filter rule}.
+    irc_index: the IrcIndex the IRC columns came from (None without one).
+    as_of: the date promotions were matched for.
+    delta: the DELTA sheet, changes since the store's previous run (set by
+        history.record_run; None when there is no history).
+    """
+    product_sales: pd.DataFrame
+    full_data: pd.DataFrame
+    supply: dict
+    horizons: tuple
+    order_matrix: np.ndarray
+    irc: Optional[pd.DataFrame]
+    irc_new: Optional[pd.DataFrame]
+    ordered_codes: set
+    dropped_rows: dict
+    min_date: pd.Timestamp
+    max_date: pd.Timestamp
+    time_frame_days: int
+    irc_index: Optional[IrcIndex] = None
+    as_of: Optional[pd.Timestamp] = None
+    delta: Optional[pd.DataFrame] = None
+
+
+def compute_reorder(df_sales, df_inventory=None, ignore_codes=(), df_irc=None, horizons=DEFAULT_HORIZONS,
+                    trailing_days=None, rules=None, timer=None, as_of=None, date_span=None):
+    """
+    Pure reorder calculation: takes the normalized frames returned by the
+    read_*_file functions and returns a ReorderResult. Does no I/O.
+    df_inventory and df_irc may be None when those files are not available.
+    df_irc may also be a prebuilt irc_index.IrcIndex. The IRC AMT and END
+    DATE columns show the promotion running on `as_of` (default: today);
+    the IRC sheets pick one promotion per code as IrcIndex describes.
+    horizons lists the supply horizons in weeks, e.g. (1, 2, 3, 4, 6, 8).
+    df_sales may be raw line items or a sales_rollup daily rollup; with
+    trailing_days set, only that many days back from the latest sale count.
+    rules is a rules.SalesRules (default: compiled from rules.json); it
+    also picks the forecast method of each department (see forecast.py).
+    timer is an optional callable (e.g. metrics.StageTimer) receiving
+    (stage, seconds, rows) as each entry of COMPUTE_STAGES finishes.
+    date_span is the (first, last) sale timestamps of a streamed rollup
+    (see stream_sales_csv); the period is measured from it, since the
+    rollup only keeps whole days. It is ignored with trailing_days set.
+    """
+    horizons = tuple(horizons)
+    if rules is None:
+        rules = default_rules()
+
+    inventory_loaded = df_inventory is not None
+    irc_loaded = df_irc is not None
+
+    if inventory_loaded:
+        # Lookups
+        inventory_lookup = df_inventory.set_index('Stock Code')['Quantity']
+        inv_desc_lookup = df_inventory.set_index('Stock Code')['Inv Description']
+        inv_dept_lookup = df_inventory.set_index('Stock Code')['Inv Department']
+
+    if as_of is None:
+        as_of = pd.Timestamp.today().normalize()
+    irc_index = None
+    if irc_loaded:
+        irc_index = df_irc if isinstance(df_irc, IrcIndex) else IrcIndex(df_irc)
+        # One promotion per code: the one that applies on as_of
+        promotions = irc_index.current(as_of)
+
+    # --- Filtering Rules ---
+    clock = time.perf_counter()
+    # All exclusion rules are combined into one mask and applied once
+    keep, dropped_rows = rules.sales_mask(df_sales, ignore_codes)
+    df_filtered = df_sales[keep].copy()
+    df_filtered['Description'] = as_text(df_filtered['Description'])
+    df_filtered['Stock Description'] = as_text(df_filtered['Stock Description'])
+
+    # --- Sales Calculations ---
+    df_filtered['Stock Date'] = pd.to_datetime(df_filtered['Stock Date'])
+    df_filtered = trailing_window(df_filtered, trailing_days)
+    clock = _lap(timer, 'filter', clock, len(df_filtered))
+    if date_span is not None and trailing_days is None:
+        min_date, max_date = date_span
+    else:
+        min_date = df_filtered['Stock Date'].min()
+        max_date = df_filtered['Stock Date'].max()
+    time_frame_days = (max_date - min_date).days if (max_date - min_date).days > 0 else 1
+
+    sku_keys = ['Stock Code', 'Stock Description', 'Description']
+    sku_groups = df_filtered.groupby(sku_keys, observed=True)
+    product_sales = sku_groups['Quantity'].sum().reset_index()
+    # One row per SKU from here on, so plain strings are cheap again
+    product_sales[sku_keys] = product_sales[sku_keys].astype(str)
+
+    product_sales['Avg Daily Sales'] = product_sales['Quantity'] / time_frame_days
+
+    # --- Week sales for every horizon (figures below 1 are ignored) ---
+    # The extra 1-week column is what special departments order
+    forecast_methods = rules.forecast_methods(product_sales['Description'])
+    product_sales['Forecast Method'] = forecast_methods
+    if len(product_sales) == 0 or (forecast_methods == 'flat').all():
+        week_sales = compute_week_sales(product_sales['Avg Daily Sales'], horizons + (1,))
+    else:
+        first_day = min_date.normalize()
+        n_days = (max_date.normalize() - first_day).days + 1
+        daily_sales = daily_sales_matrix(
+            sku_groups.ngroup(), df_filtered['Stock Date'], df_filtered['Quantity'],
+            len(product_sales), first_day, n_days,
+        )
+        week_sales = forecast_week_sales(
+            forecast_methods, horizons + (1,), product_sales['Quantity'], time_frame_days, daily_sales, first_day,
+            rules.forecast_halflife_days, rules.forecast_trend_window_days,
+        )
+    one_week_sales = week_sales[:, -1]
+    week_sales = week_sales[:, :-1]
+    week_sales_columns = [week_sales_column(weeks) for weeks in horizons]
+    product_sales = pd.concat(
+        [product_sales, pd.DataFrame(week_sales, columns=week_sales_columns, index=product_sales.index)],
+        axis=1
+    )
+    clock = _lap(timer, 'aggregate', clock, len(product_sales))
+
+    # --- Merge Inventory Data ---
+    if inventory_loaded:
+        product_sales['On Hand'] = product_sales['Stock Code'].map(inventory_lookup)
+        product_sales['On Hand'] = product_sales['On Hand'].fillna('INVENTORY UNKNOWN')
+    else:
+        product_sales['On Hand'] = 'INVENTORY UNKNOWN'
+
+    # --- Merge IRC Data ---
+    if irc_loaded:
+        irc_match = irc_index.lookup(product_sales['Stock Code'], as_of)
+        product_sales['IRC AMT'] = irc_match['IRC AMT'].to_numpy()
+        product_sales['END DATE'] = irc_match['END DATE'].to_numpy()
+    else:
+        product_sales['IRC AMT'] = ''
+        product_sales['END DATE'] = ''
+    clock = _lap(timer, 'merge', clock, len(product_sales))
+
+    # --- Sheet 1: FULL DATA ---
+    full_data = product_sales.rename(columns={'Stock Description': 'Product', 'Description': 'Department'})
+    full_data = full_data[['Department', 'Stock Code', 'Product', 'On Hand', 'IRC AMT', 'END DATE'] + week_sales_columns]
+
+    # --- Sheets 2+: WEEKLY SUPPLY ---
+    # Department mask and numeric stock are computed once for all horizons
+    numeric_on_hand = pd.to_numeric(product_sales['On Hand'], errors='coerce').to_numpy(dtype=float)
+    is_special_dept = rules.is_special(product_sales['Description'])
+
+    order_matrix = compute_order_matrix(week_sales, numeric_on_hand, is_special_dept, one_week_sales)
+    to_order = ~np.isnan(order_matrix)
+
+    supply_columns = product_sales.rename(columns={'Stock Description': 'Product', 'Description': 'Department'})
+    ordered_codes = set(product_sales['Stock Code'].astype(str)[to_order.any(axis=1)])  # items on any order sheet
+    supply = {}
+
+    for j, weeks in enumerate(horizons):
+        # Regular items first, then special-department items
+        rows = np.concatenate([
+            np.flatnonzero(to_order[:, j] & ~is_special_dept),
+            np.flatnonzero(to_order[:, j] & is_special_dept),
+        ])
+        if len(rows) == 0:
+            continue
+
+        sales_col = week_sales_column(weeks)
+        supply_df = supply_columns.iloc[rows][['Department', 'Stock Code', 'Product', 'On Hand', 'IRC AMT', 'END DATE', sales_col]]
+        supply_df = supply_df.assign(**{'Quantity to Order': order_matrix[rows, j]})
+        supply[weeks] = supply_df
+    clock = _lap(timer, 'order', clock, sum(len(df) for df in supply.values()))
+
+    # Lookups from sales for description + department
+    product_desc_lookup = product_sales.set_index('Stock Code')['Stock Description']
+    product_dept_lookup = product_sales.set_index('Stock Code')['Description']
+
+    # --- IRC SHEETS ---
+    irc_sheet_df = None
+    irc_new_sheet_df = None
+
+    if irc_loaded:
+        # Promoted codes present in sales or inventory
+        promoted_codes = promotions['Stock Code']
+        in_base = promoted_codes.isin(product_sales['Stock Code'])
         if inventory_loaded:
-            product_sales['On Hand'] = product_sales['Stock Code'].map(inventory_lookup)
-            product_sales['On Hand'] = product_sales['On Hand'].fillna('INVENTORY UNKNOWN')
-        else:
-            product_sales['On Hand'] = 'INVENTORY UNKNOWN'
-            
-        # --- Merge IRC Data ---
-        if irc_loaded:
-            product_sales['IRC AMT'] = product_sales['Stock Code'].map(irc_lookup_amt)
-            product_sales['END DATE'] = product_sales['Stock Code'].map(irc_lookup_end)
+            in_base |= promoted_codes.isin(df_inventory['Stock Code'].astype(str))
+
+        # 1 IRC sheet: in IRC + (sales or inventory) BUT NOT on any order sheet
+        irc_existing_df = promotions[in_base & ~promoted_codes.isin(ordered_codes)].copy()
+
+        # Bring in On Hand + week sales from product_sales
+        base_cols = product_sales[['Stock Code', 'On Hand'] + week_sales_columns]
+
+        irc_existing_merged = irc_existing_df.merge(
+            base_cols, on='Stock Code', how='left'
+        )
+
+        # Fill On Hand from inventory for items that never sold
+        if inventory_loaded:
+            irc_existing_merged['On Hand'] = irc_existing_merged['On Hand'].fillna(
+                irc_existing_merged['Stock Code'].map(inventory_lookup)
+            )
+
+        # Week sales: if missing, treat as 0
+        for col in week_sales_columns:
+            irc_existing_merged[col] = irc_existing_merged[col].fillna(0)
+
+        # Build final description + department:
+        # 1st choice: sales file, 2nd: inventory file, 3rd: description from IRC list
+        irc_existing_merged['Desc_from_sales'] = irc_existing_merged['Stock Code'].map(product_desc_lookup)
+        irc_existing_merged['Dept_from_sales'] = irc_existing_merged['Stock Code'].map(product_dept_lookup)
+
+        if inventory_loaded:
+            irc_existing_merged['Desc_from_inv'] = irc_existing_merged['Stock Code'].map(inv_desc_lookup)
+            irc_existing_merged['Dept_from_inv'] = irc_existing_merged['Stock Code'].map(inv_dept_lookup)
         else:
-            product_sales['IRC AMT'] = ''
-            product_sales['END DATE'] = ''
+            irc_existing_merged['Desc_from_inv'] = None
+            irc_existing_merged['Dept_from_inv'] = None
+
+        irc_existing_merged['Final_Description'] = (
+            irc_existing_merged['Desc_from_sales']
+            .combine_first(irc_existing_merged['Desc_from_inv'])
+            .combine_first(irc_existing_merged['DESCRIPTION'])
+        )
+
+        irc_existing_merged['Final_Department'] = (
+            irc_existing_merged['Dept_from_sales']
+            .combine_first(irc_existing_merged['Dept_from_inv'])
+        )
+
+        irc_sheet_df = irc_existing_merged[
+            ['Stock Code', 'Final_Description', 'On Hand'] + week_sales_columns +
+            ['IRC AMT', 'END DATE', 'Final_Department']
+        ].rename(columns={
+            'Final_Description': 'Description',
+            'Final_Department': 'Department'
+        })
+
+        # 2) IRC NEW ITEMS: only in IRC, not in sales or inventory
+        irc_new_df = promotions[~in_base].copy()
+
+        irc_new_sheet_df = irc_new_df[[
+            'Stock Code',
+            'DESCRIPTION',
+            'IRC AMT',
+            'START DATE',
+            'END DATE'
+        ]].rename(columns={'DESCRIPTION': 'Description'})
+
+        irc_new_sheet_df['Department'] = 'IRC NEW ITEMS'
+    irc_rows = sum(len(df) for df in (irc_sheet_df, irc_new_sheet_df) if df is not None)
+    _lap(timer, 'irc', clock, irc_rows)
+
+    return ReorderResult(
+        product_sales=product_sales,
+        full_data=full_data,
+        supply=supply,
+        horizons=horizons,
+        order_matrix=order_matrix,
+        irc=irc_sheet_df,
+        irc_new=irc_new_sheet_df,
+        ordered_codes=ordered_codes,
+        dropped_rows=dropped_rows,
+        min_date=min_date,
+        max_date=max_date,
+        time_frame_days=time_frame_days,
+        irc_index=irc_index,
+        as_of=as_of,
+    )
 
 
-        # --- Print Final Output to Screen ---
-        product_sales_sorted = product_sales.sort_values(by='Description')
-        print(f"\nSales data analyzed from {min_date.strftime('%Y-%m-%d')} to {max_date.strftime('%Y-%m-%d')} ({time_frame_days} days)\n")
-        for index, row in product_sales_sorted.iterrows():
-            print(f"Stock Code: {row['Stock Code']}", f"Product: {row['Stock Description']}", f"Department: {row['Description']}", sep='\n')
-            on_hand_display = int(row['On Hand']) if isinstance(row['On Hand'], (int, float)) else row['On Hand']
-            print(f"On Hand: {on_hand_display}")
-            print(f"  - Sales per 1 week: {row['1 Week Sales']:.2f}", f"  - Sales per 2 weeks: {row['2 Week Sales']:.2f}", f"  - Sales per 3 weeks: {row['3 Week Sales']:.2f}", f"  - Sales per 4 weeks: {row['4 Week Sales']:.2f}", sep='\n')
-            print("-" * 30)
+def format_console_report(result):
+    """
+    Renders the per-product console listing as one string. Every line is
+    built with column-wise string operations rather than a loop over rows.
+    """
+    product_sales_sorted = result.product_sales.sort_values(by='Description')
+    header = (
+        f"\nSales data analyzed from {result.min_date.strftime('%Y-%m-%d')} "
+        f"to {result.max_date.strftime('%Y-%m-%d')} ({result.time_frame_days} days)\n"
+    )
+    if product_sales_sorted.empty:
+        return header
+
+    # Numeric On Hand is shown as a whole number, text (e.g. INVENTORY UNKNOWN) as-is
+    on_hand = product_sales_sorted['On Hand']
+    on_hand_numeric = pd.to_numeric(on_hand, errors='coerce')
+    on_hand_display = on_hand.astype(str).where(
+        on_hand_numeric.isna(),
+        on_hand_numeric.fillna(0).astype('int64').astype(str)
+    )
+
+    def sales_line(weeks, label):
+        values = np.char.mod('%.2f', product_sales_sorted[week_sales_column(weeks)].to_numpy(dtype=float))
+        return f"  - Sales per {label}: " + pd.Series(values, index=product_sales_sorted.index)
 
+    blocks = (
+        "Stock Code: " + product_sales_sorted['Stock Code'].astype(str)
+        + "\nProduct: " + product_sales_sorted['Stock Description'].astype(str)
+        + "\nDepartment: " + product_sales_sorted['Description'].astype(str)
+        + "\nOn Hand: " + on_hand_display
+    )
+    for weeks in result.horizons:
+        blocks = blocks + "\n" + sales_line(weeks, '1 week' if weeks == 1 else f'{weeks} weeks')
+    blocks = blocks + "\n" + "-" * 30
+    return header + "\n" + "\n".join(blocks.tolist()) + "\n"
+
+
+def export_report(result, output, writer_backend='streaming', timer=None):
+    """
+    Writes the ReorderResult as the multi-sheet Excel report to `output`.
+    timer, when given, receives the 'autofit' (column sizing) and 'export'
+    (everything else) stages.
+    """
+    started = time.perf_counter()
+    with ReportWriter(output, backend=writer_backend) as writer:
+        style_and_write_sheet(result.full_data, writer, 'FULL DATA')
+
+        for i, supply_df in result.supply.items():
+            style_and_write_sheet(supply_df, writer, f'{i} WEEKS SUPPLY')
+
+        if result.irc is not None:
+            write_plain_sheet(result.irc, writer, 'IRC')
+        if result.irc_new is not None:
+            style_and_write_sheet(result.irc_new, writer, 'IRC NEW ITEMS')
+        if result.delta is not None:
+            style_and_write_sheet(result.delta, writer, 'DELTA')
+
+    if timer is not None:
+        rows = len(result.full_data) + sum(len(df) for df in result.supply.values())
+        timer('autofit', writer.autofit_seconds, None)
+        timer('export', time.perf_counter() - started - writer.autofit_seconds, rows)
+    return output
+
+#----------------------------------------------------------------------------------------------------------------------------
+
+def calculate_reorder_quantities(
+    sales_file='sales.xlsx',
+    inventory_file='inventory.xlsx',
+    ignore_file='ignore.xlsx',
+    irc_file='IRC.xlsx',
+    auto_export=False,
+    writer_backend='streaming',
+    cache=None,
+    progress=None,
+    output='reorder_report.xlsx',
+    verbose=True,
+    horizons=DEFAULT_HORIZONS,
+    rollup_store=None,
+    trailing_days=None,
+    rules=None,
+    timer=None,
+    on_result=None,
+    history=None
+):
+
+
+    """
+    Analyzes sales data and current inventory to calculate re-order quantities.
+    Writes the workbook to `output` (a path or binary file-like object) and
+    returns it, or None when no report was generated; see compute_reorder.
+    """
+    if timer is None:
+        timer = StageTimer()
+    try:
+        report_progress(progress, 'Loading input files')
+
+        # --- Load Ignore List (Optional) ---
+        try:
+            with timer.stage('load_ignore') as stage:
+                df_ignore = load_input(ignore_file, 'ignore', read_ignore_file, cache)
+                stage['rows'] = len(df_ignore)
+            ignore_codes = set(df_ignore['Stock Code'])
+            print(f"Info: Successfully loaded {len(ignore_codes)} stock codes from '{ignore_file}'.")
+        except FileNotFoundError:
+            print(f"Info: The ignore file '{ignore_file}' was not found.")
+            ignore_codes = set()
+
+        # --- Load and Process Inventory Data ---
+        try:
+            with timer.stage('load_inventory') as stage:
+                df_inventory = load_input(inventory_file, 'inventory', read_inventory_file, cache)
+                stage['rows'] = len(df_inventory)
+        except FileNotFoundError:
+            print(f"Warning: The inventory file '{inventory_file}' was not found. 'On Hand' quantities will be unknown.")
+            df_inventory = None
+
+        # --- Load and Process Sales Data ---
+        if rules is None:
+            rules = default_rules()
+        streamed_drops = date_span = None
+        with timer.stage('load_sales') as stage:
+            if input_format(sales_file) == 'csv':
+                # CSV exports can be huge: filter and roll up chunk by chunk
+                df_sales, streamed_drops, line_count, date_span = stream_sales_csv(sales_file, ignore_codes, rules)
+                print(f"Info: Sales data: streamed {line_count} CSV rows into {len(df_sales)} SKU-day rows, "
+                      f"{frame_memory_mb(df_sales):.1f} MB in memory.")
+            else:
+                df_sales = load_input(sales_file, 'sales', read_sales_file, cache)
+                print(f"Info: Sales data: {len(df_sales)} rows, {frame_memory_mb(df_sales):.1f} MB in memory.")
+            stage['rows'] = len(df_sales)
+        if rollup_store is not None:
+            with timer.stage('merge_rollup') as stage:
+                df_sales = rollup_store.merge(df_sales)
+                stage['rows'] = len(df_sales)
+            print(f"Info: Sales rollup for '{rollup_store.store_name}' now holds {len(df_sales)} SKU-day rows.")
+            date_span = None  # the stored rollup covers more than this export
+
+        # --- Load IRC Data (Optional) ---
+        try:
+            with timer.stage('load_irc') as stage:
+                df_irc = load_input(irc_file, 'irc', read_irc_file, cache)
+                stage['rows'] = len(df_irc)
+        except:
+            df_irc = None
+
+        if cache is not None:
+            print(f"Info: Input cache: {cache.hits} hit(s), {cache.misses} miss(es).")
+
+        report_progress(progress, 'Analyzing sales')
+        result = compute_reorder(df_sales, df_inventory, ignore_codes, df_irc, horizons, trailing_days, rules, timer,
+                                 date_span=date_span)
+        if streamed_drops is not None:
+            # The streamed rows were filtered while reading; count those drops too
+            result.dropped_rows = {name: count + streamed_drops.get(name, 0) for name, count in result.dropped_rows.items()}
+        dropped_summary = ', '.join(f"{name} {count}" for name, count in result.dropped_rows.items())
+        print(f"Info: Filter rules dropped {sum(result.dropped_rows.values())} sales rows ({dropped_summary}).")
+        if history is not None:
+            previous_run = record_run(result, history)
+            if result.delta is None:
+                print(f"Info: First recorded run for '{history.store_name}', no delta yet.")
+            else:
+                print(f"Info: {len(result.delta)} item(s) changed since run {previous_run} for '{history.store_name}'.")
+        if on_result is not None:
+            on_result(result)
+        if result.irc_index is not None:
+            upcoming = result.irc_index.starting_within(result.as_of, IRC_UPCOMING_DAYS)
+            print(f"Info: {len(upcoming)} IRC promotion(s) start in the next {IRC_UPCOMING_DAYS} days.")
+
+        # --- Print Final Output to Screen ---
+        if verbose:
+            sys.stdout.write(format_console_report(result))
 
         # --- Ask User to Generate Excel Report ---
-                # --- Ask User to Generate Excel Report ---
         if auto_export:
             export_choice = 'yes'
         else:
@@ -231,185 +934,16 @@ def calculate_reorder_quantities(
 
         if export_choice.lower().strip().startswith('y'):
 
+            report_progress(progress, 'Writing Excel report')
+
             try:
-                file_name = "reorder_report.xlsx"
-                with pd.ExcelWriter(file_name, engine='openpyxl') as writer:
-                    # --- Sheet 1: FULL DATA ---
-                    full_report_df = product_sales.rename(columns={'Stock Description': 'Product', 'Description': 'Department'})
-                    full_report_df = full_report_df[['Department', 'Stock Code', 'Product', 'On Hand', 'IRC AMT', 'END DATE', '1 Week Sales', '2 Week Sales', '3 Week Sales', '4 Week Sales']]
-                    style_and_write_sheet(full_report_df, writer, 'FULL DATA')
-
-                    # --- Sheets 2-5: WEEKLY SUPPLY ---
-                    numeric_on_hand = pd.to_numeric(product_sales['On Hand'], errors='coerce')
-                    
-                    is_special_dept_mask = product_sales['Description'].str.lower().isin(special_departments_lower)
-                    special_items_to_order = product_sales[is_special_dept_mask]
-                    ordered_codes = set()  # track items that are on any order sheet
-
-                    for i in range(1, 5):
-                        sales_col = f'{i} Week Sales'
-                        
-                        is_regular_dept_mask = ~product_sales['Description'].str.lower().isin(special_departments_lower)
-                        needs_ordering_regular = (numeric_on_hand < product_sales[sales_col]) | (numeric_on_hand.isna())
-                        sufficient_sales_regular = product_sales[sales_col] >= 1
-                        regular_items_to_order = product_sales[is_regular_dept_mask & needs_ordering_regular & sufficient_sales_regular]
-                        
-                        supply_df = pd.concat([regular_items_to_order, special_items_to_order]).copy()
-                        
-                        if not supply_df.empty:
-                            is_special_dept = supply_df['Description'].str.lower().isin(special_departments_lower)
-                            on_hand_numeric_filtered = pd.to_numeric(supply_df['On Hand'], errors='coerce')
-                            
-                            effective_on_hand = np.where(is_special_dept, 0, on_hand_numeric_filtered)
-
-                            base_sales = np.where(is_special_dept, supply_df['1 Week Sales'], supply_df[sales_col])
-                            
-                            qty_needed = base_sales - effective_on_hand
-                            
-                            qty_needed = np.where(on_hand_numeric_filtered.isna(), base_sales, qty_needed)
-                            
-                            supply_df['Quantity to Order'] = np.ceil(qty_needed)
-
-                            supply_df = supply_df[supply_df['Quantity to Order'] > 0]
-
-                            ordered_codes.update(supply_df['Stock Code'].astype(str).tolist())
-
-
-                            if not supply_df.empty:
-                                supply_df = supply_df.rename(columns={'Stock Description': 'Product', 'Description': 'Department'})
-                                supply_df = supply_df[['Department', 'Stock Code', 'Product', 'On Hand', 'IRC AMT', 'END DATE', sales_col, 'Quantity to Order']]
-                                style_and_write_sheet(supply_df, writer, f'{i} WEEKS SUPPLY')
-
-                    # Lookups from sales for description + department
-                    product_desc_lookup = product_sales.set_index('Stock Code')['Stock Description']
-                    product_dept_lookup = product_sales.set_index('Stock Code')['Description']
-
-
-                    # --- IRC SHEETS ---
-
-                    if irc_loaded:
-                        # Codes present in sales or inventory
-                        sales_codes = set(product_sales['Stock Code'].astype(str))
-                        if inventory_loaded:
-                            inventory_codes = set(df_inventory['Stock Code'].astype(str))
-                        else:
-                            inventory_codes = set()
-                        base_codes = sales_codes.union(inventory_codes)
-
-                        irc_codes = set(df_irc['Stock Code'].astype(str))
-
-                        # 1 IRC sheet: in IRC + (sales or inventory) BUT NOT on any order sheet
-                        irc_existing_codes = irc_codes & base_codes
-                        irc_not_ordered_codes = irc_existing_codes - ordered_codes
-
-                        irc_existing_df = df_irc[df_irc['Stock Code'].isin(irc_not_ordered_codes)].copy()
-
-                        if not irc_existing_df.empty:
-                            # Bring in On Hand + week sales from product_sales
-                            base_cols = product_sales[[
-                                'Stock Code',
-                                'On Hand',
-                                '1 Week Sales',
-                                '2 Week Sales',
-                                '3 Week Sales',
-                                '4 Week Sales'
-                            ]]
-
-                            irc_existing_merged = irc_existing_df.merge(
-                                base_cols, on='Stock Code', how='left'
-                            )
-
-                            # Fill On Hand from inventory for items that never sold
-                            if inventory_loaded:
-                                irc_existing_merged['On Hand'] = irc_existing_merged['On Hand'].fillna(
-                                    irc_existing_merged['Stock Code'].map(inventory_lookup)
-                                )
-
-                            # Week sales: if missing, treat as 0
-                            for col in ['1 Week Sales', '2 Week Sales', '3 Week Sales', '4 Week Sales']:
-                                irc_existing_merged[col] = irc_existing_merged[col].fillna(0)
-
-                            # Build final description + department:
-                            # 1st choice: sales file, 2nd: inventory file, 3rd: description from IRC list
-                            irc_existing_merged['Desc_from_sales'] = irc_existing_merged['Stock Code'].map(product_desc_lookup)
-                            irc_existing_merged['Dept_from_sales'] = irc_existing_merged['Stock Code'].map(product_dept_lookup)
-
-                            if inventory_loaded:
-                                irc_existing_merged['Desc_from_inv'] = irc_existing_merged['Stock Code'].map(inv_desc_lookup)
-                                irc_existing_merged['Dept_from_inv'] = irc_existing_merged['Stock Code'].map(inv_dept_lookup)
-                            else:
-                                irc_existing_merged['Desc_from_inv'] = None
-                                irc_existing_merged['Dept_from_inv'] = None
-
-                            irc_existing_merged['Final_Description'] = (
-                                irc_existing_merged['Desc_from_sales']
-                                .combine_first(irc_existing_merged['Desc_from_inv'])
-                                .combine_first(irc_existing_merged['DESCRIPTION'])
-                            )
-
-                            irc_existing_merged['Final_Department'] = (
-                                irc_existing_merged['Dept_from_sales']
-                                .combine_first(irc_existing_merged['Dept_from_inv'])
-                            )
-
-                            irc_sheet_df = irc_existing_merged[[
-                                'Stock Code',
-                                'Final_Description',
-                                'On Hand',
-                                '1 Week Sales',
-                                '2 Week Sales',
-                                '3 Week Sales',
-                                '4 Week Sales',
-                                'IRC AMT',
-                                'END DATE',
-                                'Final_Department'
-                            ]].rename(columns={
-                                'Final_Description': 'Description',
-                                'Final_Department': 'Department'
-                            })
-
-                            #style_and_write_sheet(irc_sheet_df, writer, 'IRC')
-                            write_plain_sheet(irc_sheet_df, writer, 'IRC')
-
-
-
-                        # 2) IRC NEW ITEMS: only in IRC, not in sales or inventory
-                        irc_new_codes = irc_codes - base_codes
-                        irc_new_df = df_irc[df_irc['Stock Code'].isin(irc_new_codes)].copy()
-
-                        if not irc_new_df.empty:
-                            irc_new_sheet_df = irc_new_df[[
-                                'Stock Code',
-                                'DESCRIPTION',
-                                'IRC AMT',
-                                'START DATE',
-                                'END DATE'
-                            ]].rename(columns={'DESCRIPTION': 'Description'})
-
-                            irc_new_sheet_df['Department'] = 'IRC NEW ITEMS'
-
-                            style_and_write_sheet(irc_new_sheet_df, writer, 'IRC NEW ITEMS')
-
-
-
-
-
-                    # --- NEW: Auto-fit column widths for all sheets ---
-                    workbook = writer.book
-                    for sheet in workbook.worksheets:
-                        for column_cells in sheet.columns:
-                            max_length = 0
-                            column_letter = column_cells[0].column_letter
-                            for cell in column_cells:
-                                try:
-                                    if len(str(cell.value)) > max_length:
-                                        max_length = len(str(cell.value))
-                                except:
-                                    pass
-                            adjusted_width = (max_length + 2)
-                            sheet.column_dimensions[column_letter].width = adjusted_width
-
-                print(f"\n✅ Success! Formatted multi-sheet report saved as {file_name}")
+                export_report(result, output, writer_backend, timer)
+
+                if isinstance(output, (str, os.PathLike)):
+                    print(f"\n✅ Success! Formatted multi-sheet report saved as {output}")
+                else:
+                    print("\n✅ Success! Formatted multi-sheet report written to memory")
+                return output
             except Exception as e:
                 print(f"\n❌ Error: Could not save the Excel file. Reason: {e}")
         else:
@@ -423,4 +957,9 @@ def calculate_reorder_quantities(
         print(f"An unexpected error occurred: {e}")
 
 if __name__ == "__main__":
-    calculate_reorder_quantities()
\ No newline at end of file
+    # Structured stage records on stderr when a log level is requested
+    if os.environ.get('ORDERGEN_LOG_LEVEL'):
+        configure_logging()
+    # ORDERGEN_PROFILE=run.prof writes a cProfile dump of the whole run
+    with profiled(os.environ.get('ORDERGEN_PROFILE')):
+        calculate_reorder_quantities(cache=default_cache())
@@ -0,0 +1,252 @@
+"""
+Batch mode: runs the reorder calculation for several stores in parallel.
+
+    python batch.py stores.json [--workers N]
+
+The manifest is a JSON file such as:
+
+    {
+        "ignore_file": "ignore.xlsx",
+        "irc_file": "IRC.xlsx",
+        "output_dir": "reports",
+        "horizons": [1, 2, 3, 4],
+        "rollup_dir": "rollups",
+        "trailing_days": 90,
+        "history_dir": "history",
+        "stores": [
+            {"name": "Store 12", "sales_file": "s12/sales.xlsx", "inventory_file": "s12/inventory.xlsx"},
+            {"name": "Store 40", "sales_file": "s40/sales.xlsx", "irc_file": "s40/IRC.xlsx"}
+        ]
+    }
+
+ignore_file and irc_file at the top level are shared by every store and are
+parsed once; a store may override irc_file. Relative paths are resolved
+against the manifest's directory. One workbook is written per store, plus
+chain_summary.xlsx with one row per store. Input files may be .xlsx, .csv or
+.parquet. With rollup_dir set, each store's
+sales are merged into its persisted daily rollup (see sales_rollup.py) and
+the report is computed from that, over the last trailing_days days if given.
+With history_dir set, each store's order quantities are recorded there and
+its workbook gets a DELTA sheet of what changed since its previous run (see
+history.py).
+"""
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
+from X import (
+    DEFAULT_HORIZONS, compute_reorder, export_report, input_format, load_input,
+    read_ignore_file, read_inventory_file, read_irc_file, read_sales_file,
+    stream_sales_csv, write_plain_sheet,
+)
+from history import OrderHistory, record_run
+from input_cache import default_cache, store_key
+from irc_index import IrcIndex
+from report_writer import ReportWriter
+from sales_rollup import SalesRollupStore
+
+
+def load_manifest(manifest_path):
+    with open(manifest_path) as fh:
+        manifest = json.load(fh)
+
+    base_dir = os.path.dirname(os.path.abspath(manifest_path))
+
+    def resolve(path):
+        return path if path is None or os.path.isabs(path) else os.path.join(base_dir, path)
+
+    stores = manifest.get('stores') or []
+    if not stores:
+        raise ValueError(f"No stores listed in '{manifest_path}'")
+    seen = set()
+    for store in stores:
+        name = store.get('name')
+        if not isinstance(name, str) or not name.strip() or 'sales_file' not in store:
+            raise ValueError(f"Every store needs a 'name' and a 'sales_file': {store}")
+        # Reports, rollups and history are keyed by name, so a repeat would overwrite them
+        if name in seen:
+            raise ValueError(f"Store '{name}' is listed more than once in '{manifest_path}'")
+        seen.add(name)
+        for key in ('sales_file', 'inventory_file', 'irc_file'):
+            store[key] = resolve(store.get(key))
+
+    manifest['ignore_file'] = resolve(manifest.get('ignore_file'))
+    manifest['irc_file'] = resolve(manifest.get('irc_file'))
+    manifest['output_dir'] = resolve(manifest.get('output_dir', 'reports'))
+    manifest['horizons'] = tuple(manifest.get('horizons', DEFAULT_HORIZONS))
+    manifest['rollup_dir'] = resolve(manifest.get('rollup_dir'))
+    manifest['trailing_days'] = manifest.get('trailing_days')
+    manifest['history_dir'] = resolve(manifest.get('history_dir'))
+    return manifest
+
+
+def report_file_name(store_name):
+    return f'reorder_report_{store_key(store_name)}.xlsx'
+
+
+def _load_optional(path, kind, reader, cache):
+    if path is None:
+        return None
+    try:
+        return load_input(path, kind, reader, cache)
+    except FileNotFoundError:
+        return None
+
+
+def run_store(store, ignore_codes, shared_irc, output_dir, horizons, writer_backend='streaming',
+              rollup_dir=None, trailing_days=None, history_dir=None):
+    """
+    Runs in a pool process: computes and writes one store's report and
+    returns a summary row with per-stage timings.
+    """
+    summary = {'Store': store['name']}
+    started = time.perf_counter()
+    try:
+        cache = default_cache()
+
+        date_span = None
+        if input_format(store['sales_file']) == 'csv':
+            df_sales, _, _, date_span = stream_sales_csv(store['sales_file'], ignore_codes)
+        else:
+            df_sales = load_input(store['sales_file'], 'sales', read_sales_file, cache)
+        if rollup_dir:
+            df_sales = SalesRollupStore(store['name'], rollup_dir).merge(df_sales)
+            date_span = None
+        df_inventory = _load_optional(store.get('inventory_file'), 'inventory', read_inventory_file, cache)
+        df_irc = shared_irc
+        if store.get('irc_file'):
+            try:
+                df_irc = load_input(store['irc_file'], 'irc', read_irc_file, cache)
+            except Exception:
+                df_irc = None
+        loaded = time.perf_counter()
+
+        result = compute_reorder(df_sales, df_inventory, ignore_codes, df_irc, horizons, trailing_days,
+                                 date_span=date_span)
+        if history_dir:
+            record_run(result, OrderHistory(store['name'], history_dir))
+        computed = time.perf_counter()
+
+        report_path = os.path.join(output_dir, report_file_name(store['name']))
+        export_report(result, report_path, writer_backend)
+        exported = time.perf_counter()
+
+        summary.update({
+            'Status': 'OK',
+            'Report': report_path,
+            'SKUs': len(result.product_sales),
+            'From': result.min_date,
+            'To': result.max_date,
+            'Days': result.time_frame_days,
+        })
+        for j, weeks in enumerate(result.horizons):
+            quantities = result.order_matrix[:, j]
+            summary[f'{weeks}W Items to Order'] = int((quantities > 0).sum())
+            summary[f'{weeks}W Units to Order'] = float(pd.Series(quantities).sum())
+        summary['IRC Items'] = 0 if result.irc is None else len(result.irc)
+        summary['IRC New Items'] = 0 if result.irc_new is None else len(result.irc_new)
+        if history_dir:
+            summary['Changed Items'] = None if result.delta is None else len(result.delta)
+        summary['Load Seconds'] = round(loaded - started, 3)
+        summary['Compute Seconds'] = round(computed - loaded, 3)
+        summary['Export Seconds'] = round(exported - computed, 3)
+    except Exception as e:
+        summary['Status'] = f'FAILED: {e}'
+    summary['Total Seconds'] = round(time.perf_counter() - started, 3)
+    return summary
+
+
+def write_chain_summary(summaries, output_path):
+    """
+    Writes the CHAIN SUMMARY sheet: one row per store plus a chain total.
+    """
+    df_summary = pd.DataFrame(summaries)
+    numeric_cols = [c for c in df_summary.columns if c.endswith(('Items to Order', 'Units to Order', 'Items')) or c == 'SKUs']
+    totals = {'Store': 'CHAIN TOTAL'}
+    for col in numeric_cols:
+        totals[col] = df_summary[col].sum()
+    df_summary = pd.concat([df_summary, pd.DataFrame([totals])], ignore_index=True)
+
+    with ReportWriter(output_path) as writer:
+        write_plain_sheet(df_summary, writer, 'CHAIN SUMMARY')
+    return df_summary
+
+
+def run_batch(manifest, workers=None, writer_backend='streaming'):
+    """
+    Runs every store in `manifest` (see load_manifest) over a process pool
+    and returns the list of per-store summary rows.
+    """
+    stores = manifest['stores']
+    output_dir = manifest['output_dir']
+    os.makedirs(output_dir, exist_ok=True)
+
+    # --- Common inputs, parsed once and shared with every store ---
+    cache = default_cache()
+    ignore_codes = set()
+    if manifest.get('ignore_file'):
+        try:
+            ignore_codes = set(load_input(manifest['ignore_file'], 'ignore', read_ignore_file, cache)['Stock Code'])
+            print(f"Info: Successfully loaded {len(ignore_codes)} stock codes from '{manifest['ignore_file']}'.")
+        except FileNotFoundError:
+            print(f"Info: The ignore file '{manifest['ignore_file']}' was not found.")
+
+    shared_irc = None
+    if manifest.get('irc_file'):
+        try:
+            # Indexed once here and shipped to every worker ready to use
+            shared_irc = IrcIndex(load_input(manifest['irc_file'], 'irc', read_irc_file, cache))
+        except Exception as e:
+            print(f"Warning: Could not load the shared IRC file '{manifest['irc_file']}': {e}")
+
+    workers = workers or min(len(stores), os.cpu_count() or 1)
+    print(f"Running {len(stores)} store(s) on {workers} worker(s)...")
+
+    started = time.perf_counter()
+    summaries = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [
+            pool.submit(
+                run_store, store, ignore_codes, shared_irc, output_dir, manifest['horizons'], writer_backend,
+                manifest['rollup_dir'], manifest['trailing_days'], manifest['history_dir'],
+            )
+            for store in stores
+        ]
+        for done, future in enumerate(as_completed(futures), start=1):
+            summary = future.result()
+            summaries.append(summary)
+            if summary['Status'] == 'OK':
+                print(
+                    f"[{done}/{len(stores)}] {summary['Store']}: done in {summary['Total Seconds']:.2f}s "
+                    f"(load {summary['Load Seconds']:.2f}s, compute {summary['Compute Seconds']:.2f}s, "
+                    f"export {summary['Export Seconds']:.2f}s)"
+                )
+            else:
+                print(f"[{done}/{len(stores)}] {summary['Store']}: {summary['Status']}")
+
+    # Keep the manifest order in the summary sheet
+    order = {store['name']: index for index, store in enumerate(stores)}
+    summaries.sort(key=lambda row: order.get(row['Store'], len(order)))
+
+    summary_path = os.path.join(output_dir, 'chain_summary.xlsx')
+    write_chain_summary(summaries, summary_path)
+    print(f"\n✅ {len(stores)} store(s) processed in {time.perf_counter() - started:.2f}s. Chain summary saved as {summary_path}")
+    return summaries
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the reorder report for several stores in parallel.")
+    parser.add_argument('manifest', help="JSON manifest listing the stores and their input files")
+    parser.add_argument('--workers', type=int, default=None, help="Worker processes (default: one per CPU, at most one per store)")
+    parser.add_argument('--writer', choices=['streaming', 'openpyxl'], default='streaming', help="Excel writer backend")
+    args = parser.parse_args(argv)
+
+    run_batch(load_manifest(args.manifest), workers=args.workers, writer_backend=args.writer)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,437 @@
+"""
+Benchmark suite: generates synthetic store data and times every stage of
+the reorder pipeline.
+
+    python benchmark.py --sizes small,medium --repeat 3 --output results.json
+    python benchmark.py --skus 8000 --days 120 --lines 300000 --sales-format csv
+    python benchmark.py --sizes small --web --compare results-main.json
+
+For each size the sales, inventory, IRC and ignore files are generated once
+under --data-dir (and reused by later runs with the same parameters). The
+pipeline is then run --repeat times in this process, timing the load stage,
+each stage of compute_reorder (see X.COMPUTE_STAGES), the column auto-fit
+and the Excel export. A separate pass under tracemalloc records the peak
+memory of every stage. --web also times the Flask upload path (upload, job
+run and download) through the test client.
+
+Results are written as JSON, one entry per size, so runs from different
+versions can be compared with --compare.
+"""
+import argparse
+import datetime
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import openpyxl
+import pandas as pd
+
+from X import (
+    COMPUTE_STAGES, DEFAULT_HORIZONS, compute_reorder, export_report, input_format,
+    read_ignore_file, read_inventory_file, read_irc_file, read_sales_file, stream_sales_csv,
+)
+from input_cache import InputCache
+from rules import default_rules
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+# Preset data sizes; --skus, --days and --lines override them
+SIZES = {
+    'small': {'skus': 500, 'days': 30, 'lines': 5_000},
+    'medium': {'skus': 5_000, 'days': 90, 'lines': 100_000},
+    'large': {'skus': 20_000, 'days': 180, 'lines': 1_000_000},
+}
+
+# Benchmark temp dirs must not start with jobs.JOB_DIR_PREFIX: the web app's
+# janitor deletes those
+DEFAULT_DATA_DIR = os.path.join(tempfile.gettempdir(), 'bench-ordergen')
+
+STAGES = ['load'] + COMPUTE_STAGES + ['autofit', 'export']
+WEB_STAGES = ['web_upload', 'web_job', 'web_download']
+
+
+# --- Synthetic data ---
+
+def generate_store(data_dir, skus, days, lines, departments=40, special_share=0.15, ignored_share=0.05,
+                   irc_share=0.05, sales_format='xlsx', seed=0):
+    """
+    Writes sales, inventory, IRC and ignore files shaped like the real
+    exports into data_dir and returns their paths. Sales are spread over
+    SKUs with a long-tailed popularity so a few items sell most units.
+    special_share of the departments are special departments and
+    ignored_share of the sales lines fall in departments the rules ignore,
+    both taken from rules.json. Files already generated with the same
+    parameters are reused.
+    """
+    params = {
+        'skus': skus, 'days': days, 'lines': lines, 'departments': departments,
+        'special_share': special_share, 'ignored_share': ignored_share,
+        'irc_share': irc_share, 'sales_format': sales_format, 'seed': seed,
+    }
+    paths = {
+        'sales_file': os.path.join(data_dir, f'sales.{sales_format}'),
+        'inventory_file': os.path.join(data_dir, 'inventory.xlsx'),
+        'ignore_file': os.path.join(data_dir, 'ignore.xlsx'),
+        'irc_file': os.path.join(data_dir, 'IRC.xlsx'),
+    }
+    marker = os.path.join(data_dir, 'params.json')
+    try:
+        with open(marker) as fh:
+            if json.load(fh) == params:
+                return paths
+    except (OSError, ValueError):
+        pass
+
+    os.makedirs(data_dir, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    rules = default_rules()
+
+    # Departments: regular ones plus a share of special departments
+    n_special = min(len(rules.special_departments), round(departments * special_share))
+    dept_names = np.array(
+        rules.special_departments[:n_special] + [f'DEPARTMENT {i:02d}' for i in range(departments - n_special)]
+    )
+    codes = np.array([str(100000 + i) for i in range(skus)])
+    descriptions = np.array([f'PRODUCT {i} {rng.choice(["500G", "1L", "12PK", "EACH"])}' for i in range(skus)])
+    sku_dept = dept_names[rng.integers(0, len(dept_names), skus)]
+
+    # --- Sales lines: long-tailed popularity over SKUs ---
+    popularity = 1.0 / np.arange(1, skus + 1) ** 0.8
+    popularity = rng.permutation(popularity / popularity.sum())
+    sku_index = rng.choice(skus, size=lines, p=popularity)
+    line_dept = sku_dept[sku_index]
+    ignored = rng.random(lines) < ignored_share
+    if rules.departments_to_ignore:
+        line_dept = np.where(ignored, rng.choice(rules.departments_to_ignore, size=lines), line_dept)
+    start = pd.Timestamp('2026-01-01')
+    sales = pd.DataFrame({
+        'Stock Date': start + pd.to_timedelta(rng.integers(0, days, lines), unit='D'),
+        'Stock Code': codes[sku_index],
+        'Stock Description': descriptions[sku_index],
+        'Description': line_dept,
+        'Quantity': rng.choice([1, 1, 1, 2, 2, 3, 4, 6], size=lines),
+    }).sort_values('Stock Date', kind='stable')
+    if sales_format == 'csv':
+        sales.to_csv(paths['sales_file'], index=False)
+    elif sales_format == 'parquet':
+        sales.to_parquet(paths['sales_file'], index=False)
+    else:
+        sales.to_excel(paths['sales_file'], index=False)
+
+    # --- Inventory: 90% of SKUs; description in column C, department in column O ---
+    stocked = rng.permutation(skus)[:int(skus * 0.9)]
+    inventory = {'Stock Code': codes[stocked], 'Supplier': 'SUPPLIER', 'Description': descriptions[stocked]}
+    for k in range(3, 14):
+        inventory[f'Field {k}'] = ''
+    inventory['Department'] = sku_dept[stocked]
+    inventory['Quantity'] = rng.integers(-2, 40, len(stocked))
+    pd.DataFrame(inventory).to_excel(paths['inventory_file'], index=False)
+
+    # --- IRC list: codes in A, description in B, amount in D, dates in H and I ---
+    n_irc = max(1, int(skus * irc_share))
+    irc_codes = np.concatenate([
+        rng.choice(codes, size=n_irc, replace=False),
+        [str(900000 + i) for i in range(max(1, n_irc // 10))],  # promoted items not stocked yet
+    ])
+    irc_start = start + pd.to_timedelta(rng.integers(0, days + 30, len(irc_codes)), unit='D')
+    pd.DataFrame({
+        'Stock Code': irc_codes,
+        'Description': [f'IRC {code}' for code in irc_codes],
+        'Vendor': 'VENDOR',
+        'IRC AMT': rng.integers(1, 5, len(irc_codes)).astype(float),
+        'Field E': '', 'Field F': '', 'Field G': '',
+        'START DATE': irc_start,
+        'END DATE': irc_start + pd.Timedelta(days=28),
+    }).to_excel(paths['irc_file'], index=False)
+
+    # --- Ignore list: 1% of SKUs ---
+    ignore_codes = rng.choice(codes, size=max(1, skus // 100), replace=False)
+    pd.DataFrame({'Stock Code': ignore_codes}).to_excel(paths['ignore_file'], index=False)
+
+    with open(marker, 'w') as fh:
+        json.dump(params, fh)
+    return paths
+
+
+# --- Pipeline runs ---
+
+class StageRecorder:
+    """
+    Collects seconds (and, while tracemalloc is tracing, peak traced MB)
+    per stage.
+    """
+
+    def __init__(self):
+        self.seconds = {}
+        self.peak_mb = {}
+
+    def __call__(self, stage, seconds, rows=None):
+        self.seconds[stage] = self.seconds.get(stage, 0.0) + seconds
+        if tracemalloc.is_tracing():
+            peak = tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+            self.peak_mb[stage] = max(self.peak_mb.get(stage, 0.0), peak)
+            tracemalloc.reset_peak()
+
+    def time(self, stage, func, *args, **kwargs):
+        started = time.perf_counter()
+        result = func(*args, **kwargs)
+        self(stage, time.perf_counter() - started)
+        return result
+
+
+def _load_inputs(paths, rules):
+    ignore_codes = set(read_ignore_file(paths['ignore_file'])['Stock Code'])
+    df_inventory = read_inventory_file(paths['inventory_file'])
+    date_span = None
+    if input_format(paths['sales_file']) == 'csv':
+        df_sales, _, _, date_span = stream_sales_csv(paths['sales_file'], ignore_codes, rules)
+    else:
+        df_sales = read_sales_file(paths['sales_file'])
+    df_irc = read_irc_file(paths['irc_file'])
+    return df_sales, df_inventory, ignore_codes, df_irc, date_span
+
+
+def run_pipeline(paths, horizons=DEFAULT_HORIZONS, writer_backend='streaming'):
+    """
+    Runs the pipeline once, in memory and without the input cache. Returns
+    (recorder, info) where info describes the data that was processed.
+    """
+    rules = default_rules()
+    recorder = StageRecorder()
+    df_sales, df_inventory, ignore_codes, df_irc, date_span = recorder.time('load', _load_inputs, paths, rules)
+    result = compute_reorder(df_sales, df_inventory, ignore_codes, df_irc, horizons, rules=rules, timer=recorder,
+                             date_span=date_span)
+    # export_report reports 'autofit' and 'export' separately
+    report = export_report(result, io.BytesIO(), writer_backend, timer=recorder)
+    info = {
+        'sales_rows': len(df_sales),
+        'skus': len(result.product_sales),
+        'report_bytes': report.getbuffer().nbytes,
+    }
+    return recorder, info
+
+
+def run_web(paths, repeat, poll_interval=0.05):
+    """
+    Times the web upload path through Flask's test client: the upload
+    request, the background job until it reports done, and the download.
+    The jobs get a private input cache that is emptied before each run, so
+    every run parses the files.
+    """
+    # The pool processes are spawned on the first upload and read this then
+    cache = InputCache(os.path.join(tempfile.gettempdir(), 'bench-ordergen-cache'))
+    os.environ['ORDERGEN_CACHE_DIR'] = cache.cache_dir
+    import web_app
+
+    client = web_app.app.test_client()
+    samples = {stage: [] for stage in WEB_STAGES}
+
+    def upload():
+        files = {
+            name: (open(path, 'rb'), os.path.basename(path))
+            for name, path in paths.items()
+        }
+        try:
+            return client.post('/', data=files, content_type='multipart/form-data')
+        finally:
+            for fh, _ in files.values():
+                fh.close()
+
+    try:
+        for run in range(repeat + 1):  # the first run only starts the worker pool
+            cache.clear()
+            started = time.perf_counter()
+            response = upload()
+            if response.status_code != 202:
+                raise RuntimeError(f"Upload failed with HTTP {response.status_code}: {response.get_data(as_text=True)}")
+            uploaded = time.perf_counter()
+
+            status_url = response.get_json()['status_url']
+            while True:
+                status = client.get(status_url).get_json()
+                if status['state'] in ('done', 'failed'):
+                    break
+                time.sleep(poll_interval)
+            if status['state'] == 'failed':
+                raise RuntimeError(f"Web job failed: {status['error']}")
+            finished = time.perf_counter()
+
+            download = client.get(status['download_url'])
+            if download.status_code != 200:
+                raise RuntimeError(f"Download failed with HTTP {download.status_code}")
+            downloaded = time.perf_counter()
+
+            if run:
+                samples['web_upload'].append(uploaded - started)
+                samples['web_job'].append(finished - uploaded)
+                samples['web_download'].append(downloaded - finished)
+    finally:
+        web_app.job_queue.shutdown()
+    return samples
+
+
+def _summarize(samples):
+    return {
+        stage: {'median': round(statistics.median(values), 6), 'min': round(min(values), 6)}
+        for stage, values in samples.items() if values
+    }
+
+
+def _max_rss_mb():
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return round(rss / (1024 * 1024) if sys.platform == 'darwin' else rss / 1024, 1)
+
+
+def benchmark_case(name, paths, params, repeat=3, horizons=DEFAULT_HORIZONS, writer_backend='streaming',
+                   web=False):
+    """
+    Benchmarks one generated data set and returns its result entry.
+    """
+    samples = {stage: [] for stage in STAGES}
+    samples['total'] = []
+    for _ in range(repeat):
+        recorder, info = run_pipeline(paths, horizons, writer_backend)
+        for stage, seconds in recorder.seconds.items():
+            samples[stage].append(seconds)
+        samples['total'].append(sum(recorder.seconds.values()))
+
+    # Memory pass: tracing slows everything down, so it is not timed
+    tracemalloc.start()
+    try:
+        recorder, _ = run_pipeline(paths, horizons, writer_backend)
+    finally:
+        tracemalloc.stop()
+
+    if web:
+        samples.update(run_web(paths, repeat))
+
+    return {
+        'name': name,
+        'params': params,
+        'data': info,
+        'seconds': _summarize(samples),
+        'peak_mb': {stage: round(mb, 2) for stage, mb in recorder.peak_mb.items()},
+        'max_rss_mb': _max_rss_mb(),
+    }
+
+
+def environment():
+    return {
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'numpy': np.__version__,
+        'openpyxl': openpyxl.__version__,
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+    }
+
+
+# --- Reporting ---
+
+def print_case(case):
+    print(f"\n{case['name']}: {case['data']['sales_rows']} sales rows, {case['data']['skus']} SKUs")
+    print(f"  {'stage':<14}{'median s':>10}{'min s':>10}{'peak MB':>10}")
+    for stage, timing in case['seconds'].items():
+        peak = case['peak_mb'].get(stage)
+        peak_text = f"{peak:>10.1f}" if peak is not None else f"{'':>10}"
+        print(f"  {stage:<14}{timing['median']:>10.3f}{timing['min']:>10.3f}{peak_text}")
+    if case['max_rss_mb'] is not None:
+        print(f"  max RSS: {case['max_rss_mb']:.1f} MB")
+
+
+def compare_results(baseline, current):
+    """
+    Prints the median time of every stage next to a baseline result file's,
+    for the sizes both runs share.
+    """
+    base_cases = {case['name']: case for case in baseline['cases']}
+    print(f"\nCompared with '{baseline.get('label')}' ({baseline.get('created')}):")
+    for case in current['cases']:
+        base = base_cases.get(case['name'])
+        if base is None or base['params'] != case['params']:
+            print(f"  {case['name']}: no matching baseline")
+            continue
+        print(f"  {case['name']}:")
+        for stage, timing in case['seconds'].items():
+            old = base['seconds'].get(stage)
+            if old is None:
+                continue
+            ratio = timing['median'] / old['median'] if old['median'] else float('nan')
+            print(f"    {stage:<14}{old['median']:>10.3f} -> {timing['median']:>8.3f}  ({ratio:.2f}x)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the reorder pipeline on synthetic store data.")
+    parser.add_argument('--sizes', default='small', help=f"Comma separated presets: {', '.join(SIZES)}")
+    parser.add_argument('--skus', type=int, help="Custom size: number of SKUs (replaces --sizes)")
+    parser.add_argument('--days', type=int, help="Custom size: days of sales")
+    parser.add_argument('--lines', type=int, help="Custom size: sales lines")
+    parser.add_argument('--departments', type=int, default=40)
+    parser.add_argument('--special-share', type=float, default=0.15, help="Share of departments that are special")
+    parser.add_argument('--sales-format', choices=['xlsx', 'csv', 'parquet'], default='xlsx')
+    parser.add_argument('--repeat', type=int, default=3, help="Timed runs per size (median and min are reported)")
+    parser.add_argument('--writer', choices=['streaming', 'openpyxl'], default='streaming', help="Excel writer backend")
+    parser.add_argument('--web', action='store_true', help="Also time the web upload path")
+    parser.add_argument('--data-dir', default=DEFAULT_DATA_DIR, help="Where generated data is kept between runs")
+    parser.add_argument('--label', default='', help="Free-form label stored with the results, e.g. a version")
+    parser.add_argument('--output', default='benchmark_results.json', help="JSON file the results are written to")
+    parser.add_argument('--compare', help="Earlier results file to compare against")
+    args = parser.parse_args(argv)
+    if args.repeat < 1:
+        parser.error("--repeat must be at least 1")
+
+    if args.skus or args.days or args.lines:
+        custom = dict(SIZES['small'])
+        custom.update({k: v for k, v in (('skus', args.skus), ('days', args.days), ('lines', args.lines)) if v})
+        sizes = {'custom': custom}
+    else:
+        names = [name.strip() for name in args.sizes.split(',') if name.strip()]
+        unknown = [name for name in names if name not in SIZES]
+        if unknown:
+            parser.error(f"Unknown size(s): {', '.join(unknown)}")
+        sizes = {name: SIZES[name] for name in names}
+
+    results = {
+        'label': args.label,
+        'created': datetime.datetime.now().isoformat(timespec='seconds'),
+        'environment': environment(),
+        'repeat': args.repeat,
+        'writer_backend': args.writer,
+        'cases': [],
+    }
+    for name, size in sizes.items():
+        params = dict(size, departments=args.departments, special_share=args.special_share,
+                      sales_format=args.sales_format)
+        data_dir = os.path.join(args.data_dir, '-'.join(f'{k}{v}' for k, v in params.items()))
+        print(f"Generating '{name}' data in {data_dir}...")
+        paths = generate_store(data_dir, **params)
+
+        print(f"Benchmarking '{name}' ({args.repeat} run(s))...")
+        case = benchmark_case(name, paths, params, args.repeat, writer_backend=args.writer, web=args.web)
+        results['cases'].append(case)
+        print_case(case)
+
+    with open(args.output, 'w') as fh:
+        json.dump(results, fh, indent=2)
+    print(f"\nResults saved as {args.output}")
+
+    if args.compare:
+        with open(args.compare) as fh:
+            compare_results(json.load(fh), results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+"""
+Demand forecasts for every SKU at once, from a SKU x day sales matrix.
+
+Each method turns a SKU's daily sales history into expected sales over
+each supply horizon (the 'N Week Sales' figures):
+
+    flat      total quantity / days in the period (the original rule)
+    ewma      exponentially weighted daily average, recent days count more
+    seasonal  ewma of the weekday-adjusted series times the SKU's
+              day-of-week profile over the days the horizon covers
+    trend     least-squares line through the last trend_window_days,
+              extrapolated over the horizon (never below zero)
+
+The method is chosen per department (see rules.SalesRules.forecast_methods)
+and every method works on whole arrays, never per SKU.
+"""
+import numpy as np
+import pandas as pd
+
+FORECAST_METHODS = ('flat', 'ewma', 'seasonal', 'trend')
+
+DEFAULT_HALFLIFE_DAYS = 14
+DEFAULT_TREND_WINDOW_DAYS = 28
+
+
+def daily_sales_matrix(sku_ids, dates, quantities, n_skus, first_day, n_days):
+    """
+    (n_skus, n_days) array of units sold per SKU per day, where day 0 is
+    first_day. sku_ids are row numbers (0..n_skus-1) for each sales line.
+    """
+    days = (pd.DatetimeIndex(dates).normalize() - first_day).days.to_numpy()
+    cells = np.asarray(sku_ids, dtype=np.int64) * n_days + days
+    totals = np.bincount(cells, weights=np.asarray(quantities, dtype=float), minlength=n_skus * n_days)
+    return totals.reshape(n_skus, n_days)
+
+
+def _ewma_weights(n_days, halflife):
+    # Weight halves every `halflife` days going back from the last day
+    return 0.5 ** ((n_days - 1 - np.arange(n_days)) / halflife)
+
+
+def ewma_rate(matrix, halflife=DEFAULT_HALFLIFE_DAYS):
+    """
+    Exponentially weighted average daily sales per SKU.
+    """
+    weights = _ewma_weights(matrix.shape[1], halflife)
+    return matrix @ weights / weights.sum()
+
+
+def weekdays(first_day, n_days):
+    """
+    Day of week (Monday=0) of each of n_days days starting at first_day.
+    """
+    return (first_day.dayofweek + np.arange(n_days)) % 7
+
+
+def weekday_profile(matrix, first_day):
+    """
+    (n_skus, 7) day-of-week factors: each weekday's average sales relative
+    to the SKU's weekday-balanced average. Weekdays the period does not
+    cover, and SKUs with no sales, get a factor of 1.
+    """
+    day_of_week = weekdays(first_day, matrix.shape[1])
+    one_hot = np.eye(7)[day_of_week]                       # (n_days, 7)
+    day_counts = one_hot.sum(axis=0)
+    covered = day_counts > 0
+    weekday_mean = np.zeros((matrix.shape[0], 7))
+    weekday_mean[:, covered] = (matrix @ one_hot)[:, covered] / day_counts[covered]
+    balanced_mean = weekday_mean[:, covered].mean(axis=1, keepdims=True)
+    profile = np.ones_like(weekday_mean)
+    selling = balanced_mean[:, 0] > 0
+    profile[np.ix_(selling, covered)] = weekday_mean[np.ix_(selling, covered)] / balanced_mean[selling]
+    return profile
+
+
+def _horizon_days(horizons):
+    return 7 * np.asarray(horizons, dtype=int)
+
+
+def forecast_flat(total_quantity, time_frame_days, horizons):
+    days = _horizon_days(horizons)
+    return np.outer(np.asarray(total_quantity, dtype=float) / time_frame_days, days)
+
+
+def forecast_ewma(matrix, horizons, halflife=DEFAULT_HALFLIFE_DAYS):
+    return np.outer(ewma_rate(matrix, halflife), _horizon_days(horizons))
+
+
+def forecast_seasonal(matrix, first_day, horizons, halflife=DEFAULT_HALFLIFE_DAYS):
+    """
+    Weekday-adjusted ewma level, spread over the days each horizon covers
+    (starting the day after the last day of the matrix) with the SKU's
+    day-of-week profile.
+    """
+    n_days = matrix.shape[1]
+    profile = weekday_profile(matrix, first_day)
+    history_profile = profile[:, weekdays(first_day, n_days)]
+    # Weekdays a SKU never sells on carry no information about its level
+    adjusted = np.divide(matrix, history_profile, out=np.zeros_like(matrix), where=history_profile > 0)
+    level = ewma_rate(adjusted, halflife)
+
+    days = _horizon_days(horizons)
+    future_weekdays = weekdays(first_day + pd.Timedelta(days=n_days), int(days.max()))
+    cumulative = np.cumsum(profile[:, future_weekdays], axis=1)   # profile summed over the first k days
+    return level[:, None] * cumulative[:, days - 1]
+
+
+def forecast_trend(matrix, horizons, window=DEFAULT_TREND_WINDOW_DAYS):
+    """
+    Fits sales = a + b * day over the last `window` days and sums the line
+    over each horizon. Totals are clipped at zero.
+    """
+    recent = matrix[:, -window:]
+    n = recent.shape[1]
+    x = np.arange(n) - (n - 1) / 2                  # centred day numbers
+    mean = recent.mean(axis=1)
+    slope = recent @ x / (x @ x) if n > 1 else np.zeros(len(recent))
+
+    # Future day k (1..D) sits at x = (n - 1) / 2 + k
+    days = _horizon_days(horizons).astype(float)
+    offset = days * (n - 1) / 2 + days * (days + 1) / 2
+    totals = np.outer(mean, days) + np.outer(slope, offset)
+    return np.clip(totals, 0, None)
+
+
+def forecast_week_sales(methods, horizons, total_quantity, time_frame_days, matrix=None, first_day=None,
+                        halflife=DEFAULT_HALFLIFE_DAYS, trend_window=DEFAULT_TREND_WINDOW_DAYS):
+    """
+    (n_skus, n_horizons) expected sales per horizon, each SKU forecast with
+    the method named in `methods` (an array aligned with the SKUs). matrix
+    and first_day (see daily_sales_matrix) are only needed for methods
+    other than 'flat'. Figures below 1 are zeroed so they never trigger an
+    order.
+    """
+    methods = np.asarray(methods)
+    unknown = set(np.unique(methods)) - set(FORECAST_METHODS)
+    if unknown:
+        raise ValueError(f"Unknown forecast method(s): {', '.join(sorted(unknown))}")
+
+    week_sales = np.zeros((len(methods), len(horizons)))
+    for method in FORECAST_METHODS:
+        rows = np.flatnonzero(methods == method)
+        if len(rows) == 0:
+            continue
+        if method == 'flat':
+            week_sales[rows] = forecast_flat(np.asarray(total_quantity)[rows], time_frame_days, horizons)
+        elif method == 'ewma':
+            week_sales[rows] = forecast_ewma(matrix[rows], horizons, halflife)
+        elif method == 'seasonal':
+            week_sales[rows] = forecast_seasonal(matrix[rows], first_day, horizons, halflife)
+        else:
+            week_sales[rows] = forecast_trend(matrix[rows], horizons, trend_window)
+
+    week_sales[week_sales < 1] = 0
+    return week_sales
@@ -0,0 +1,37 @@
+"""
+Production server settings:
+
+    gunicorn -c gunicorn.conf.py web_app:app
+
+The app is preloaded, so pandas, openpyxl and the pipeline modules are
+imported once in the master and shared by the forked workers. Each worker
+then starts its report job processes right away; they load the reference
+files (ignore list, inventory, IRC list, rules) once and keep them in
+memory until a file changes, so a request only pays for its uploads.
+"""
+import os
+
+bind = os.environ.get('ORDERGEN_BIND', '0.0.0.0:5000')
+
+# Jobs are tracked in the worker that accepted them, so status polls and
+# downloads must reach the same worker: scale with threads (and
+# ORDERGEN_JOB_WORKERS for report processes) rather than web workers
+workers = int(os.environ.get('ORDERGEN_WEB_WORKERS', '1'))
+threads = int(os.environ.get('ORDERGEN_WEB_THREADS', '8'))
+timeout = 120
+
+preload_app = True
+
+
+def when_ready(server):
+    # Parse the reference files once in the master so every job process
+    # starts from the on-disk input cache instead of the workbooks
+    from reference import reference_data
+    reference_data().preload()
+
+
+def post_worker_init(worker):
+    # The pool is created after the fork; starting it here runs the
+    # reference data preload before the first request arrives
+    from web_app import job_queue
+    job_queue.warm_up()
@@ -0,0 +1,185 @@
+"""
+Order history: each run's order quantities per store, and what changed
+since the previous run.
+
+A run is reduced to a snapshot with one row per stock code (see
+order_snapshot). The delta between two snapshots is an outer join on
+Stock Code that keeps only the codes whose Quantity to Order (at any
+horizon), On Hand or IRC promotion changed, so the DELTA sheet grows with
+the number of changes rather than with the catalog.
+"""
+import os
+
+import numpy as np
+import pandas as pd
+
+from input_cache import read_frame, store_key, write_frame
+
+DEFAULT_HISTORY_DIR = os.environ.get('ORDERGEN_HISTORY_DIR', os.path.expanduser('~/.local/share/ordergen/history'))
+DEFAULT_HISTORY_KEEP = int(os.environ.get('ORDERGEN_HISTORY_KEEP', '30'))
+
+SNAPSHOT_COLUMNS = ['Stock Code', 'Department', 'Product', 'On Hand', 'IRC AMT', 'END DATE']
+
+# Suffix of the previous run's columns in the joined frame
+_PREVIOUS = ' (previous)'
+
+
+def order_column(weeks):
+    return f'{weeks} Week Order'
+
+
+def _order_columns(snapshot):
+    return [column for column in snapshot.columns if column.endswith(' Week Order')]
+
+
+def order_snapshot(result):
+    """
+    One row per stock code of a ReorderResult: its department, product, On
+    Hand and IRC promotion, and the quantity to order at each horizon (0
+    where nothing is ordered). Unknown On Hand and missing IRC values are
+    NaN / NaT.
+    """
+    product_sales = result.product_sales
+    snapshot = pd.DataFrame({
+        'Stock Code': product_sales['Stock Code'].astype(str).to_numpy(),
+        'Department': product_sales['Description'].astype(str).to_numpy(),
+        'Product': product_sales['Stock Description'].astype(str).to_numpy(),
+        'On Hand': pd.to_numeric(product_sales['On Hand'], errors='coerce').to_numpy(dtype=float),
+        'IRC AMT': pd.to_numeric(product_sales['IRC AMT'], errors='coerce').to_numpy(dtype=float),
+        'END DATE': pd.to_datetime(product_sales['END DATE'], errors='coerce').to_numpy(),
+    })
+    orders = np.nan_to_num(result.order_matrix, nan=0.0)
+    for j, weeks in enumerate(result.horizons):
+        snapshot[order_column(weeks)] = orders[:, j]
+
+    # A code sold under several descriptions is one line in the history
+    if snapshot['Stock Code'].duplicated().any():
+        aggregations = {column: 'first' for column in SNAPSHOT_COLUMNS[1:]}
+        aggregations.update({column: 'sum' for column in _order_columns(snapshot)})
+        snapshot = snapshot.groupby('Stock Code', sort=False).agg(aggregations).reset_index()
+    return snapshot
+
+
+def _changed(merged, column):
+    previous, current = merged[column + _PREVIOUS], merged[column]
+    return ~((previous == current) | (previous.isna() & current.isna())).to_numpy()
+
+
+def order_delta(previous, current):
+    """
+    The codes whose order quantities, On Hand or IRC promotion (IRC AMT or
+    END DATE) differ between two snapshots, with the previous and current
+    value of each. Status is NEW or REMOVED for codes found in only one run
+    (compared against no order, unknown stock and no promotion) and
+    CHANGED otherwise; Changes names what changed.
+    """
+    order_columns = list(dict.fromkeys(_order_columns(current) + _order_columns(previous)))
+    previous = previous.reindex(columns=SNAPSHOT_COLUMNS + order_columns)
+    current = current.reindex(columns=SNAPSHOT_COLUMNS + order_columns)
+    previous[order_columns] = previous[order_columns].fillna(0.0)
+    current[order_columns] = current[order_columns].fillna(0.0)
+
+    merged = previous.merge(current, on='Stock Code', how='outer', suffixes=(_PREVIOUS, ''), indicator=True, sort=False)
+    for column in order_columns:
+        merged[column + _PREVIOUS] = merged[column + _PREVIOUS].fillna(0.0)
+        merged[column] = merged[column].fillna(0.0)
+
+    quantity_changed = np.zeros(len(merged), dtype=bool)
+    for column in order_columns:
+        quantity_changed |= _changed(merged, column)
+    on_hand_changed = _changed(merged, 'On Hand')
+    irc_changed = _changed(merged, 'IRC AMT') | _changed(merged, 'END DATE')
+
+    keep = quantity_changed | on_hand_changed | irc_changed
+    merged = merged[keep].reset_index(drop=True)
+    labels = [
+        (quantity_changed[keep], 'Quantity to Order'),
+        (on_hand_changed[keep], 'On Hand'),
+        (irc_changed[keep], 'IRC'),
+    ]
+    changes = pd.Series('', index=merged.index)
+    for flags, label in labels:
+        changes = changes + np.where(flags, label + ', ', '')
+
+    delta = pd.DataFrame({
+        'Department': merged['Department'].combine_first(merged['Department' + _PREVIOUS]),
+        'Stock Code': merged['Stock Code'],
+        'Product': merged['Product'].combine_first(merged['Product' + _PREVIOUS]),
+        'Status': np.select(
+            [merged['_merge'] == 'right_only', merged['_merge'] == 'left_only'], ['NEW', 'REMOVED'], 'CHANGED'
+        ),
+        'Changes': changes.str.rstrip(', '),
+    })
+    for column in ['On Hand', 'IRC AMT', 'END DATE'] + order_columns:
+        delta['Previous ' + column] = merged[column + _PREVIOUS]
+        delta[column] = merged[column]
+    return delta
+
+
+class OrderHistory:
+    """
+    Order snapshots of one store's runs, stored one file per run under
+    root_dir/<store key> (see store_key). Only the latest `keep` runs are
+    kept. Raises ValueError for a store name that cannot be stored.
+    """
+
+    def __init__(self, store_name, root_dir=DEFAULT_HISTORY_DIR, keep=DEFAULT_HISTORY_KEEP):
+        self.store_name = store_name
+        self.keep = keep
+        root_dir = os.path.realpath(root_dir)
+        self.store_dir = os.path.join(root_dir, store_key(store_name))
+        if os.path.dirname(os.path.realpath(self.store_dir)) != root_dir:
+            raise ValueError(f"Store name '{store_name}' does not map to a directory under {root_dir}.")
+        os.makedirs(self.store_dir, exist_ok=True)
+
+    def runs(self):
+        """
+        Ids of the stored runs (UTC timestamps), oldest first.
+        """
+        run_ids = set()
+        for name in os.listdir(self.store_dir):
+            stem, extension = os.path.splitext(name)
+            if extension in ('.parquet', '.pkl'):
+                run_ids.add(stem)
+        return sorted(run_ids)
+
+    def load(self, run_id):
+        snapshot, _ = read_frame(os.path.join(self.store_dir, run_id))
+        return snapshot
+
+    def latest(self):
+        """
+        (run id, snapshot) of the most recent readable run, or (None, None).
+        """
+        for run_id in reversed(self.runs()):
+            snapshot = self.load(run_id)
+            if snapshot is not None:
+                return run_id, snapshot
+        return None, None
+
+    def record(self, snapshot):
+        """
+        Stores a run's snapshot, drops runs beyond `keep` and returns the
+        new run id.
+        """
+        run_id = pd.Timestamp.now(tz='UTC').strftime('%Y%m%dT%H%M%S%fZ')
+        write_frame(os.path.join(self.store_dir, run_id), snapshot)
+        for old_id in self.runs()[:-self.keep]:
+            for extension in ('.parquet', '.pkl'):
+                path = os.path.join(self.store_dir, old_id + extension)
+                if os.path.exists(path):
+                    os.remove(path)
+        return run_id
+
+
+def record_run(result, history):
+    """
+    Records `result` in `history` and sets result.delta to the changes
+    since the store's previous run (None for its first run). Returns the
+    previous run's id, or None.
+    """
+    snapshot = order_snapshot(result)
+    previous_id, previous = history.latest()
+    result.delta = order_delta(previous, snapshot) if previous is not None else None
+    history.record(snapshot)
+    return previous_id
@@ -0,0 +1,189 @@
+import hashlib
+import os
+import pickle
+import re
+
+import pandas as pd
+
+try:
+    import pyarrow  # noqa: F401  (enables the Parquet format)
+    HAVE_PYARROW = True
+except ImportError:
+    HAVE_PYARROW = False
+
+# Bump when a reader in X.py changes the shape of the frame it returns,
+# so stale entries are never served after an upgrade.
+CACHE_VERSION = 3
+
+DEFAULT_CACHE_DIR = os.environ.get('ORDERGEN_CACHE_DIR', os.path.expanduser('~/.cache/ordergen'))
+DEFAULT_CACHE_MAX_MB = int(os.environ.get('ORDERGEN_CACHE_MAX_MB', '512'))
+
+_HASH_CHUNK = 1024 * 1024
+
+
+def file_digest(source):
+    """
+    SHA-256 of a file path or a binary file-like object. File-like objects
+    are rewound afterwards so they can still be parsed.
+    """
+    digest = hashlib.sha256()
+    if hasattr(source, 'read'):
+        source.seek(0)
+        for chunk in iter(lambda: source.read(_HASH_CHUNK), b''):
+            digest.update(chunk)
+        source.seek(0)
+    else:
+        with open(source, 'rb') as fh:
+            for chunk in iter(lambda: fh.read(_HASH_CHUNK), b''):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _write_atomic(path, write):
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def write_frame(stem, df):
+    """
+    Atomically stores df at stem + '.parquet' (or '.pkl' when Parquet is
+    unavailable or cannot hold the frame) and returns the path written.
+    Any copy in the other format is removed so readers never see stale data.
+    """
+    parquet_path, pickle_path = stem + '.parquet', stem + '.pkl'
+    if HAVE_PYARROW:
+        try:
+            _write_atomic(parquet_path, lambda tmp: df.to_parquet(tmp, index=False))
+            _remove(pickle_path)
+            return parquet_path
+        except Exception:
+            pass
+    _write_atomic(pickle_path, lambda tmp: df.to_pickle(tmp, protocol=pickle.HIGHEST_PROTOCOL))
+    _remove(parquet_path)
+    return pickle_path
+
+
+def read_frame(stem):
+    """
+    Returns (df, path) for the frame stored at `stem`, or (None, None) when
+    there is none. Unreadable files are deleted.
+    """
+    for path, read in ((stem + '.parquet', pd.read_parquet), (stem + '.pkl', pd.read_pickle)):
+        if os.path.exists(path):
+            try:
+                return read(path), path
+            except Exception:
+                _remove(path)
+    return None, None
+
+
+def store_key(store_name):
+    """
+    File-system-safe key for a store name: a readable slug plus a hash of
+    the exact name, so 'Store 12' and 'Store_12' get different keys and no
+    name ('.', '..') can resolve outside the directory it is joined to.
+    Raises ValueError for a blank name.
+    """
+    if not store_name or not store_name.strip():
+        raise ValueError("Store name is required.")
+    slug = re.sub(r'[^A-Za-z0-9_-]+', '_', store_name).strip('_')[:60] or 'store'
+    return f"{slug}-{hashlib.sha256(store_name.encode('utf-8')).hexdigest()[:12]}"
+
+
+class InputCache:
+    """
+    On-disk cache of parsed input frames, keyed by the SHA-256 of the file
+    contents. Frames are stored as Parquet when pyarrow is available (Pickle
+    otherwise, or when a frame has mixed-type columns Parquet cannot hold).
+    The least recently used entries are evicted once the directory grows
+    past max_bytes.
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_CACHE_MAX_MB * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _entry_stem(self, source, kind):
+        return os.path.join(self.cache_dir, f'{kind}-v{CACHE_VERSION}-{file_digest(source)}')
+
+    def get_or_load(self, source, kind, reader):
+        """
+        Returns the cached frame for `source`, or parses it with `reader`
+        and stores the result.
+        """
+        stem = self._entry_stem(source, kind)
+
+        # Corrupt or unreadable entries are dropped by read_frame and re-parsed
+        df, path = read_frame(stem)
+        if df is not None:
+            os.utime(path)  # mark as recently used
+            self.hits += 1
+            return df
+
+        self.misses += 1
+        df = reader(source)
+        try:
+            write_frame(stem, df)
+        except OSError as e:
+            # A cache that cannot be written must never break a report
+            print(f"Warning: Could not write input cache entry: {e}")
+        self.evict()
+        return df
+
+    def _entries(self):
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith('.tmp'):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def evict(self):
+        """
+        Removes least recently used entries until the cache fits in max_bytes.
+        """
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            _remove(path)
+            total -= size
+
+    def clear(self):
+        for _, _, path in self._entries():
+            _remove(path)
+
+
+_default_cache = None
+
+
+def default_cache():
+    """
+    Process-wide InputCache configured from ORDERGEN_CACHE_DIR and
+    ORDERGEN_CACHE_MAX_MB.
+    """
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = InputCache()
+    return _default_cache
@@ -0,0 +1,89 @@
+import numpy as np
+import pandas as pd
+
+
+class IrcIndex:
+    """
+    IRC promotions (read_irc_file rows) indexed by stock code and date
+    interval. A code may have several promotions; for a given date the one
+    that applies is, in order of preference:
+
+      1. an active promotion (START DATE <= date <= END DATE), the most
+         recently started one if several overlap;
+      2. otherwise the next upcoming promotion (earliest START DATE);
+      3. otherwise the promotion that ended last.
+
+    That choice drives the IRC sheets (current); the product columns only
+    show a promotion running on the date (lookup). A missing START DATE
+    counts as "since always" and a missing END DATE as open-ended. All
+    lookups are vectorized over the whole list. The index holds plain
+    arrays, so it can be cached or sent to pool processes.
+    """
+
+    def __init__(self, df_irc):
+        self.frame = df_irc.reset_index(drop=True)
+        self.frame['Stock Code'] = self.frame['Stock Code'].astype(str)
+        self._code_ids, self.codes = pd.factorize(self.frame['Stock Code'])
+
+        # Dates as float nanoseconds so missing bounds can be +/- infinity
+        start = pd.to_datetime(self.frame['START DATE'], errors='coerce')
+        end = pd.to_datetime(self.frame['END DATE'], errors='coerce')
+        self._start = np.where(start.isna(), -np.inf, start.to_numpy(dtype='datetime64[ns]').astype('int64'))
+        self._end = np.where(end.isna(), np.inf, end.to_numpy(dtype='datetime64[ns]').astype('int64'))
+        self._selected = {}
+
+    def __len__(self):
+        return len(self.frame)
+
+    @staticmethod
+    def _date_ns(on_date):
+        return float(pd.Timestamp(on_date).normalize().value)
+
+    def selected_rows(self, on_date):
+        """
+        Positions (in file order) of the one promotion that applies to each
+        code on `on_date`.
+        """
+        day = self._date_ns(on_date)
+        if day not in self._selected:
+            active = (self._start <= day) & (day <= self._end)
+            upcoming = self._start > day
+            rank = np.where(active, 0, np.where(upcoming, 1, 2))
+            # Within a rank, smaller keys win: latest start, earliest start, latest end
+            key = np.where(active, -self._start, np.where(upcoming, self._start, -self._end))
+            positions = np.arange(len(self.frame))
+            order = np.lexsort((positions, key, rank, self._code_ids))
+            ids = self._code_ids[order]
+            first = np.ones(len(order), dtype=bool)
+            first[1:] = ids[1:] != ids[:-1]
+            self._selected[day] = np.sort(order[first])
+        return self._selected[day]
+
+    def current(self, on_date):
+        """
+        One row per code: the promotion that applies on `on_date`, in the
+        order the codes first appear in the IRC list.
+        """
+        return self.frame.iloc[self.selected_rows(on_date)]
+
+    def lookup(self, codes, on_date, columns=('IRC AMT', 'END DATE')):
+        """
+        The `columns` of the promotion active on `on_date` for each of
+        `codes`, aligned with `codes`; NaN for codes with no promotion
+        running that day, so upcoming or expired ones never look current.
+        """
+        day = self._date_ns(on_date)
+        rows = self.selected_rows(on_date)
+        rows = rows[(self._start[rows] <= day) & (day <= self._end[rows])]
+        chosen = self.frame.iloc[rows].set_index('Stock Code')
+        return chosen.reindex(pd.Index(codes).astype(str))[list(columns)].reset_index(drop=True)
+
+    def starting_within(self, on_date, days):
+        """
+        Promotions starting after `on_date` and at most `days` days later,
+        earliest first.
+        """
+        day = self._date_ns(on_date)
+        horizon = day + pd.Timedelta(days=days).value
+        rows = np.flatnonzero((self._start > day) & (self._start <= horizon))
+        return self.frame.iloc[rows[np.argsort(self._start[rows], kind='stable')]]
@@ -0,0 +1,310 @@
+import contextlib
+import io
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+from X import PIPELINE_STAGES, calculate_reorder_quantities
+from metrics import DEFAULT_PROFILE_DIR, StageTimer, log_event, observe_job, profiled
+from reference import reference_data, warm_worker
+from report_api import report_sheets, report_summary
+
+REPORT_NAME = "reorder_report.xlsx"
+
+# Upload directories are created with this prefix so the janitor can find them
+JOB_DIR_PREFIX = "ordergen-"
+
+DEFAULT_MAX_WORKERS = int(os.environ.get('ORDERGEN_JOB_WORKERS', str(min(2, os.cpu_count() or 1))))
+DEFAULT_MAX_PENDING = int(os.environ.get('ORDERGEN_JOB_QUEUE', '8'))
+DEFAULT_MAX_FINISHED = int(os.environ.get('ORDERGEN_JOB_KEEP', '32'))
+DEFAULT_JOB_TTL = int(os.environ.get('ORDERGEN_JOB_TTL', '3600'))
+DEFAULT_JANITOR_INTERVAL = int(os.environ.get('ORDERGEN_JANITOR_INTERVAL', '300'))
+
+
+class QueueFull(Exception):
+    """Raised when a job is submitted while the queue is at capacity."""
+
+
+def make_job_dir():
+    return tempfile.mkdtemp(prefix=JOB_DIR_PREFIX)
+
+
+def cleanup_stale_dirs(max_age, keep=()):
+    """
+    Removes upload directories older than max_age seconds, except those in
+    `keep`. Catches directories left behind by crashed or restarted workers.
+    """
+    cutoff = time.time() - max_age
+    root = tempfile.gettempdir()
+    removed = 0
+    for name in os.listdir(root):
+        path = os.path.join(root, name)
+        if not name.startswith(JOB_DIR_PREFIX) or path in keep:
+            continue
+        try:
+            if not os.path.isdir(path) or os.path.getmtime(path) >= cutoff:
+                continue
+        except OSError:
+            continue
+        shutil.rmtree(path, ignore_errors=True)
+        removed += 1
+    return removed
+
+
+def _write_progress(job_dir, stage):
+    tmp_path = os.path.join(job_dir, 'progress.tmp')
+    with open(tmp_path, 'w') as fh:
+        fh.write(stage)
+    os.replace(tmp_path, os.path.join(job_dir, 'progress'))
+
+
+def run_report_job(job_dir, inputs, profile_path=None):
+    """
+    Runs in a pool process. Builds the report in memory and returns a dict
+    with the workbook bytes ('report'), the sheets and run summary served by
+    the JSON / HTML views ('sheets' and 'summary', see report_api) and the
+    run's stage timings and input cache counters ('metrics', see
+    metrics.observe_job). The
+    per-product console listing is skipped and the remaining messages are
+    captured instead of going to the server's stdout. With profile_path
+    set, the run is profiled and the cProfile stats are written there.
+
+    Reference files (the defaults used when a field is left empty) and the
+    rules come from the process's warm ReferenceData, so only the uploads
+    are parsed.
+    """
+    _write_progress(job_dir, 'Starting')
+    log = io.StringIO()
+    cache = reference_data()
+    hits, misses = cache.hits, cache.misses
+    timer = StageTimer(job_dir=os.path.basename(job_dir))
+    views = {}
+
+    def keep_views(result):
+        views['sheets'] = report_sheets(result)
+        history = inputs.get('history')
+        views['summary'] = report_summary(result, history.store_name if history is not None else None)
+
+    with contextlib.redirect_stdout(log), profiled(profile_path):
+        report = calculate_reorder_quantities(
+            **inputs,
+            auto_export=True,
+            cache=cache,
+            progress=lambda stage: _write_progress(job_dir, stage),
+            output=io.BytesIO(),
+            verbose=False,
+            rules=cache.rules(),
+            timer=timer,
+            on_result=keep_views,
+        )
+
+    if report is None:
+        # The pipeline reports failures on the console; surface the last line
+        lines = [line.strip() for line in log.getvalue().splitlines() if line.strip()]
+        raise RuntimeError(lines[-1] if lines else "Could not generate the report.")
+    return {
+        'report': report.getvalue(),
+        'sheets': views['sheets'],
+        'summary': views['summary'],
+        'metrics': {
+            'stages': timer.stages,
+            'cache_hits': cache.hits - hits,
+            'cache_misses': cache.misses - misses,
+        },
+    }
+
+
+class Job:
+    def __init__(self, job_id, job_dir, future, profile_path=None):
+        self.id = job_id
+        self.dir = job_dir
+        self.future = future
+        self.profile_path = profile_path
+        self.submitted = time.time()
+        self.finished = None
+
+
+class JobQueue:
+    """
+    Runs report jobs on a bounded process pool. At most max_workers jobs run
+    at once and at most max_pending jobs are queued or running. Finished
+    reports are kept in memory until they are ttl seconds old or more than
+    max_finished have piled up.
+    """
+
+    def __init__(self, max_workers=DEFAULT_MAX_WORKERS, max_pending=DEFAULT_MAX_PENDING,
+                 max_finished=DEFAULT_MAX_FINISHED, ttl=DEFAULT_JOB_TTL,
+                 janitor_interval=DEFAULT_JANITOR_INTERVAL, profile_dir=DEFAULT_PROFILE_DIR):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.max_finished = max_finished
+        self.ttl = ttl
+        self.janitor_interval = janitor_interval
+        self.profile_dir = profile_dir
+        self._executor = None
+        self._janitor = None
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def _pool(self):
+        if self._executor is None:
+            # spawn: forking a threaded web server process is not safe.
+            # Each process loads the reference data once as it starts.
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=warm_worker,
+            )
+        return self._executor
+
+    def warm_up(self):
+        """
+        Starts every pool process now, so the first reports do not wait for
+        Python, pandas and the reference data to load.
+        """
+        futures = [self._pool().submit(time.sleep, 0.1) for _ in range(self.max_workers)]
+        for future in futures:
+            future.result()
+
+    def _start_janitor(self):
+        if self._janitor is not None:
+            return
+
+        def run():
+            while True:
+                time.sleep(self.janitor_interval)
+                self.expire()
+                with self._lock:
+                    active = {job.dir for job in self._jobs.values() if not job.future.done()}
+                cleanup_stale_dirs(self.ttl, keep=active)
+
+        self._janitor = threading.Thread(target=run, name='ordergen-janitor', daemon=True)
+        self._janitor.start()
+
+    def _finish(self, job):
+        job.finished = time.time()
+        # The uploads are no longer needed once the report exists
+        shutil.rmtree(job.dir, ignore_errors=True)
+
+        if job.future.cancelled():
+            state, error = 'failed', 'cancelled'
+        else:
+            error = job.future.exception()
+            state = 'failed' if error is not None else 'done'
+        job_metrics = job.future.result()['metrics'] if state == 'done' else None
+        seconds = job.finished - job.submitted
+        observe_job(job_metrics, state, seconds)
+        log_event('job', f"job {job.id} {state} in {seconds:.2f}s", job_id=job.id, state=state,
+                  seconds=round(seconds, 3), error=str(error) if error else None,
+                  stages=job_metrics['stages'] if job_metrics else None)
+
+    def pending(self):
+        with self._lock:
+            return sum(1 for job in self._jobs.values() if not job.future.done())
+
+    def submit(self, job_dir, inputs, profile=False):
+        """
+        Queues a report for the files in `inputs` (calculate_reorder_quantities
+        keyword arguments) and returns the new job id. job_dir is removed
+        once the job finishes. profile=True writes a cProfile dump of the run
+        to profile_dir/<job id>.prof; it is ignored when no profile_dir is set.
+        """
+        self._start_janitor()
+        self.expire()
+        with self._lock:
+            pending = sum(1 for job in self._jobs.values() if not job.future.done())
+            if pending >= self.max_pending:
+                raise QueueFull(f"{pending} reports are already queued, try again shortly.")
+
+            job_id = uuid.uuid4().hex
+            profile_path = None
+            if profile and self.profile_dir:
+                os.makedirs(self.profile_dir, exist_ok=True)
+                profile_path = os.path.join(self.profile_dir, f'{job_id}.prof')
+            future = self._pool().submit(run_report_job, job_dir, inputs, profile_path)
+            job = Job(job_id, job_dir, future, profile_path)
+            self._jobs[job_id] = job
+        future.add_done_callback(lambda _: self._finish(job))
+        return job_id
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def status(self, job):
+        """
+        Returns a JSON-friendly dict describing the job.
+        """
+        info = {'id': job.id, 'error': None}
+        stage = None
+        try:
+            with open(os.path.join(job.dir, 'progress')) as fh:
+                stage = fh.read()
+        except OSError:
+            pass
+
+        if job.future.cancelled():
+            info['state'] = 'failed'
+            info['error'] = 'cancelled'
+        elif job.future.done():
+            error = job.future.exception()
+            if error is None:
+                info['state'] = 'done'
+                stage = 'Done'
+            else:
+                info['state'] = 'failed'
+                info['error'] = str(error)
+        elif stage is not None:
+            info['state'] = 'running'
+        else:
+            info['state'] = 'queued'
+
+        info['stage'] = stage
+        info['step'] = PIPELINE_STAGES.index(stage) + 1 if stage in PIPELINE_STAGES else None
+        info['steps'] = len(PIPELINE_STAGES)
+        if job.profile_path:
+            info['profile'] = job.profile_path
+        return info
+
+    def report(self, job):
+        """
+        Returns the finished workbook as an in-memory file, or None.
+        """
+        if job.future.done() and not job.future.cancelled() and job.future.exception() is None:
+            return io.BytesIO(job.future.result()['report'])
+        return None
+
+    def views(self, job):
+        """
+        Returns (summary, sheets) of the finished report (see
+        report_api.report_sheets), or None.
+        """
+        if job.future.done() and not job.future.cancelled() and job.future.exception() is None:
+            result = job.future.result()
+            return result['summary'], result['sheets']
+        return None
+
+    def expire(self):
+        """
+        Forgets finished jobs older than ttl, then the oldest finished jobs
+        beyond max_finished.
+        """
+        cutoff = time.time() - self.ttl
+        with self._lock:
+            finished = sorted(
+                (job for job in self._jobs.values() if job.finished is not None),
+                key=lambda job: job.finished,
+            )
+            overflow = max(0, len(finished) - self.max_finished)
+            for index, job in enumerate(finished):
+                if index < overflow or job.finished < cutoff:
+                    del self._jobs[job.id]
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,291 @@
+"""
+Instrumentation for report runs: per-stage timers that emit structured log
+records, an optional cProfile hook, and a small metrics registry rendered
+in the Prometheus text exposition format (served at /metrics by web_app).
+
+Metrics live in the process that records them. Report jobs run in pool
+processes, so each job returns its stage timings and cache counters with
+its result and the web process records them here (see observe_job).
+"""
+import contextlib
+import cProfile
+import json
+import logging
+import math
+import os
+import threading
+import time
+
+logger = logging.getLogger('ordergen')
+
+# Directory for per-run cProfile dumps requested through the web app;
+# unset means profiling cannot be requested over HTTP
+DEFAULT_PROFILE_DIR = os.environ.get('ORDERGEN_PROFILE_DIR')
+
+
+# --- Structured logging ---
+
+class JsonLogFormatter(logging.Formatter):
+    """
+    One JSON object per record. Fields passed as extra={'fields': {...}}
+    are merged into the object.
+    """
+
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        entry.update(getattr(record, 'fields', {}))
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def configure_logging(level=None):
+    """
+    Sends 'ordergen' records to stderr as JSON lines, at `level` or
+    ORDERGEN_LOG_LEVEL (default INFO). Does nothing if already configured.
+    """
+    if logger.handlers:
+        return
+    handler = logging.StreamHandler()
+    handler.setFormatter(JsonLogFormatter())
+    logger.addHandler(handler)
+    logger.setLevel(level or os.environ.get('ORDERGEN_LOG_LEVEL', 'INFO'))
+    logger.propagate = False
+
+
+def log_event(event, message, **fields):
+    logger.info(message, extra={'fields': dict(fields, event=event)})
+
+
+# --- Stage timing ---
+
+class StageTimer:
+    """
+    Records how long each stage of one run takes and how many rows it
+    produced, logging a structured 'stage' record for each. An instance can
+    be passed as the timer callback of compute_reorder. `context` fields
+    (e.g. job_id) are added to every log record.
+    """
+
+    def __init__(self, **context):
+        self.context = context
+        self.stages = []
+
+    def __call__(self, stage, seconds, rows=None):
+        self.stages.append({'stage': stage, 'seconds': seconds, 'rows': rows})
+        log_event('stage', f"{stage} took {seconds:.3f}s", stage=stage, seconds=round(seconds, 6), rows=rows,
+                  **self.context)
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """
+        Times the block as stage `name`. Set info['rows'] on the yielded
+        dict to record a row count. Nothing is recorded if the block raises.
+        """
+        info = {'rows': None}
+        started = time.perf_counter()
+        yield info
+        self(name, time.perf_counter() - started, info['rows'])
+
+
+@contextlib.contextmanager
+def profiled(path):
+    """
+    Runs the block under cProfile and writes the stats to `path` (readable
+    with pstats or snakeviz). A falsy path disables profiling.
+    """
+    if not path:
+        yield
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(path)
+        log_event('profile', f"profile written to {path}", path=path)
+
+
+# --- Metrics registry ---
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, math.inf)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _samples(self):
+        with self._lock:
+            return [(self.name, key, (), value) for key, value in sorted(self._values.items())]
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        for name, key, extra, value in self._samples():
+            lines.append(f'{name}{_format_labels(self.labelnames, key, extra)} {_format_value(value)}')
+        return lines
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+
+class Gauge(_Metric):
+    """
+    A value that can go up and down, read from the callable given to
+    set_function every time the metrics are rendered.
+    """
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._function = None
+
+    def set_function(self, function):
+        self._function = function
+
+    def _samples(self):
+        if self._function is not None:
+            return [(self.name, (), (), self._function())]
+        return super()._samples()
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets) if math.inf in buckets else tuple(buckets) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+            self._values[key] = (counts, total + value)
+
+    def _samples(self):
+        samples = []
+        with self._lock:
+            for key, (counts, total) in sorted(self._values.items()):
+                for bound, count in zip(self.buckets, counts):
+                    samples.append((f'{self.name}_bucket', key, [('le', _format_value(bound))], count))
+                samples.append((f'{self.name}_sum', key, (), total))
+                samples.append((f'{self.name}_count', key, (), counts[-1]))
+        return samples
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = []
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._add(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._add(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._add(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self):
+        """
+        All metrics in the Prometheus text exposition format.
+        """
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = MetricsRegistry()
+
+REQUEST_DURATION = REGISTRY.histogram(
+    'ordergen_http_request_duration_seconds', 'Time spent handling HTTP requests.',
+    ['method', 'endpoint', 'status'])
+STAGE_DURATION = REGISTRY.histogram(
+    'ordergen_stage_duration_seconds', 'Time spent in each stage of a report run.', ['stage'])
+STAGE_ROWS = REGISTRY.counter(
+    'ordergen_stage_rows_total', 'Rows produced by each stage of a report run.', ['stage'])
+JOB_DURATION = REGISTRY.histogram(
+    'ordergen_job_duration_seconds', 'Time from submitting a report job to its completion.', ['state'])
+JOBS = REGISTRY.counter('ordergen_jobs_total', 'Finished report jobs.', ['state'])
+QUEUE_DEPTH = REGISTRY.gauge('ordergen_job_queue_depth', 'Report jobs queued or running.')
+CACHE_LOOKUPS = REGISTRY.counter(
+    'ordergen_input_cache_lookups_total', 'Input cache lookups made by report jobs.', ['result'])
+CACHE_HIT_RATIO = REGISTRY.gauge(
+    'ordergen_input_cache_hit_ratio', 'Share of input cache lookups by report jobs that were hits.')
+
+
+def _cache_hit_ratio():
+    hits, misses = CACHE_LOOKUPS.value(result='hit'), CACHE_LOOKUPS.value(result='miss')
+    return hits / (hits + misses) if hits + misses else 0.0
+
+
+CACHE_HIT_RATIO.set_function(_cache_hit_ratio)
+
+
+def observe_job(job_metrics, state, seconds):
+    """
+    Records a finished job: its state and duration, plus the stage timings
+    and cache counters it returned (job_metrics may be None for failures).
+    """
+    JOBS.inc(state=state)
+    JOB_DURATION.observe(seconds, state=state)
+    if not job_metrics:
+        return
+    for entry in job_metrics.get('stages', ()):
+        STAGE_DURATION.observe(entry['seconds'], stage=entry['stage'])
+        if entry.get('rows') is not None:
+            STAGE_ROWS.inc(entry['rows'], stage=entry['stage'])
+    CACHE_LOOKUPS.inc(job_metrics.get('cache_hits', 0), result='hit')
+    CACHE_LOOKUPS.inc(job_metrics.get('cache_misses', 0), result='miss')
@@ -0,0 +1,157 @@
+"""
+Warm reference data for long-running servers.
+
+The ignore list, inventory snapshot, IRC list and department rules change
+rarely compared with sales uploads. ReferenceData keeps them parsed in
+memory, checks each file's modification time and size on every use and
+reloads a file only when it has changed. The IRC list is kept as a ready
+IrcIndex.
+
+Every report job process holds one ReferenceData (see warm_worker, the
+pool initializer in jobs.py), so a job only parses the uploaded files.
+"""
+import os
+import threading
+
+from X import read_ignore_file, read_inventory_file, read_irc_file
+from input_cache import default_cache
+from irc_index import IrcIndex
+from metrics import log_event
+from rules import DEFAULT_RULES_FILE, load_rules
+
+# Where the server looks for the files used when a form field is left empty
+DEFAULT_REFERENCE_DIR = os.environ.get('ORDERGEN_REFERENCE_DIR', os.getcwd())
+
+REFERENCE_FILES = {
+    'ignore': 'ignore.xlsx',
+    'inventory': 'inventory.xlsx',
+    'irc': 'IRC.xlsx',
+}
+
+READERS = {
+    'ignore': read_ignore_file,
+    'inventory': read_inventory_file,
+    'irc': read_irc_file,
+}
+
+# Lookup structures built from the parsed frame and kept instead of it
+BUILDERS = {
+    'irc': IrcIndex,
+}
+
+
+def reference_path(kind, reference_dir=DEFAULT_REFERENCE_DIR):
+    return os.path.abspath(os.path.join(reference_dir, REFERENCE_FILES[kind]))
+
+
+def _signature(path):
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+class ReferenceData:
+    """
+    In-memory reference files, reloaded when they change on disk. It has
+    the same get_or_load interface as input_cache.InputCache, so it can be
+    passed as the `cache` of calculate_reorder_quantities: the reference
+    paths are served from memory and everything else (the uploads) goes
+    through `cache`.
+    """
+
+    def __init__(self, reference_dir=DEFAULT_REFERENCE_DIR, cache=None, rules_file=DEFAULT_RULES_FILE):
+        self.paths = {kind: reference_path(kind, reference_dir) for kind in REFERENCE_FILES}
+        self.cache = cache
+        self.rules_file = rules_file
+        self.reference_hits = 0
+        self.reference_loads = 0
+        self._entries = {}
+        self._rules = None
+        self._lock = threading.Lock()
+
+    # Counters summed with the wrapped cache, as jobs report them
+    @property
+    def hits(self):
+        return self.reference_hits + (self.cache.hits if self.cache is not None else 0)
+
+    @property
+    def misses(self):
+        return self.reference_loads + (self.cache.misses if self.cache is not None else 0)
+
+    def _tracked_path(self, source):
+        if not isinstance(source, (str, os.PathLike)):
+            return None
+        path = os.path.abspath(source)
+        return path if path in self.paths.values() else None
+
+    def get_or_load(self, source, kind, reader):
+        path = self._tracked_path(source)
+        if path is None:
+            if self.cache is not None:
+                return self.cache.get_or_load(source, kind, reader)
+            return reader(source)
+
+        signature = _signature(path)  # FileNotFoundError is handled by the caller
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry[0] == signature:
+                self.reference_hits += 1
+                return entry[1]
+
+        value = self.cache.get_or_load(path, kind, reader) if self.cache is not None else reader(path)
+        if kind in BUILDERS:
+            value = BUILDERS[kind](value)
+        with self._lock:
+            self._entries[path] = (signature, value)
+            self.reference_loads += 1
+        log_event('reference', f"loaded {kind} reference data from {path}", kind=kind, path=path, rows=len(value))
+        return value
+
+    def rules(self):
+        """
+        The department rules, reloaded when the rules file changes.
+        """
+        signature = _signature(self.rules_file)
+        with self._lock:
+            if self._rules is not None and self._rules[0] == signature:
+                return self._rules[1]
+        rules = load_rules(self.rules_file)
+        with self._lock:
+            self._rules = (signature, rules)
+        log_event('reference', f"loaded rules from {self.rules_file}", kind='rules', path=self.rules_file)
+        return rules
+
+    def preload(self):
+        """
+        Loads every reference file that exists, plus the rules.
+        """
+        for kind, path in self.paths.items():
+            try:
+                self.get_or_load(path, kind, READERS[kind])
+            except FileNotFoundError:
+                pass
+        self.rules()
+
+
+_reference_data = None
+
+
+def reference_data():
+    """
+    Process-wide ReferenceData backed by the default input cache.
+    """
+    global _reference_data
+    if _reference_data is None:
+        _reference_data = ReferenceData(cache=default_cache())
+    return _reference_data
+
+
+def warm_worker():
+    """
+    Pool initializer: loads the reference data once when a job process
+    starts, so the first job does not pay for it.
+    """
+    try:
+        reference_data().preload()
+    except Exception as e:
+        # A bad reference file must not stop the pool; jobs report it
+        log_event('reference', f"could not preload reference data: {e}", error=str(e))
@@ -0,0 +1,223 @@
+"""
+Report views served by the web app next to the Excel download.
+
+A finished job keeps the sheets of its report as frames (see
+report_sheets), so the JSON and HTML endpoints read order lines straight
+from memory instead of re-parsing the workbook. Both take the same query
+parameters (see parse_report_query): department and horizon filters, and
+page / per_page for pagination.
+"""
+import datetime
+import math
+
+import numpy as np
+import pandas as pd
+
+# Rows per page of the HTML view, and the most either view returns per page
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 5000
+
+
+def report_sheets(result):
+    """
+    The sheets the views serve, from a ReorderResult: one entry per weekly
+    supply sheet, then IRC, IRC NEW ITEMS and DELTA. Each entry is a dict
+    with the sheet 'name', its 'kind' ('supply', 'irc', 'irc_new' or
+    'delta'), 'weeks' (None except for supply sheets) and the 'frame',
+    sorted by Department like the workbook. Only plain data, so it can
+    travel back from a pool process.
+    """
+    sheets = []
+    for weeks, supply_df in result.supply.items():
+        sheets.append({'name': f'{weeks} WEEKS SUPPLY', 'kind': 'supply', 'weeks': weeks, 'frame': supply_df})
+    if result.irc is not None:
+        sheets.append({'name': 'IRC', 'kind': 'irc', 'weeks': None, 'frame': result.irc})
+    if result.irc_new is not None:
+        sheets.append({'name': 'IRC NEW ITEMS', 'kind': 'irc_new', 'weeks': None, 'frame': result.irc_new})
+    if result.delta is not None:
+        sheets.append({'name': 'DELTA', 'kind': 'delta', 'weeks': None, 'frame': result.delta})
+
+    for sheet in sheets:
+        sheet['frame'] = sheet['frame'].sort_values(by='Department', kind='stable').reset_index(drop=True)
+    return sheets
+
+
+def report_summary(result, store_name=None):
+    """
+    Run-level facts shown with every view.
+    """
+    return {
+        'store': store_name,
+        'as_of': result.as_of.date().isoformat() if result.as_of is not None else None,
+        'period_start': result.min_date.date().isoformat(),
+        'period_end': result.max_date.date().isoformat(),
+        'period_days': int(result.time_frame_days),
+        'horizons': [int(weeks) for weeks in result.horizons],
+    }
+
+
+# --- Query parameters ---
+
+def _split_values(args, name):
+    # Accepts both ?department=A&department=B and ?department=A,B
+    values = []
+    for raw in args.getlist(name):
+        values.extend(value.strip() for value in raw.split(',') if value.strip())
+    return values
+
+
+def _positive_int(args, name, default):
+    raw = args.get(name)
+    if raw is None or raw == '':
+        return default
+    try:
+        value = int(raw)
+    except ValueError:
+        raise ValueError(f"'{name}' must be a whole number, got '{raw}'.")
+    if value < 1:
+        raise ValueError(f"'{name}' must be at least 1.")
+    return value
+
+
+def parse_report_query(args, default_page_size=None):
+    """
+    Parses the view parameters from a request's query string (a werkzeug
+    MultiDict):
+
+        department  departments to keep (case-insensitive), repeated or comma-separated
+        horizon     supply horizons in weeks to keep; other sheets are always kept
+        irc         '0' leaves out the IRC sheets
+        page        1-based page number
+        per_page    rows per page (default_page_size; None returns every row)
+
+    Raises ValueError with a message fit for the client.
+    """
+    horizons = []
+    for value in _split_values(args, 'horizon'):
+        try:
+            horizons.append(int(value))
+        except ValueError:
+            raise ValueError(f"'horizon' must list whole numbers of weeks, got '{value}'.")
+
+    per_page = _positive_int(args, 'per_page', default_page_size)
+    if per_page is not None and per_page > MAX_PAGE_SIZE:
+        raise ValueError(f"'per_page' can be at most {MAX_PAGE_SIZE}.")
+    page = _positive_int(args, 'page', 1)
+    if per_page is None and page != 1:
+        raise ValueError("'page' needs 'per_page'.")
+
+    departments = _split_values(args, 'department')
+    return {
+        'departments': sorted({value.upper() for value in departments}) or None,
+        'horizons': sorted(set(horizons)) or None,
+        'irc': args.get('irc', '1') != '0',
+        'page': page,
+        'per_page': per_page,
+    }
+
+
+# --- Selection ---
+
+def select_sheets(sheets, query):
+    """
+    The sheets that pass the horizon / irc filters, each with its frame
+    narrowed to the requested departments.
+    """
+    selected = []
+    for sheet in sheets:
+        if sheet['kind'] == 'supply':
+            if query['horizons'] is not None and sheet['weeks'] not in query['horizons']:
+                continue
+        elif sheet['kind'] in ('irc', 'irc_new') and not query['irc']:
+            continue
+
+        frame = sheet['frame']
+        if query['departments'] is not None:
+            departments = frame['Department'].astype(str).str.upper()
+            frame = frame[departments.isin(query['departments']).to_numpy()]
+        selected.append(dict(sheet, frame=frame))
+    return selected
+
+
+def paginate(frame, page, per_page):
+    """
+    (rows of the requested page, page info dict).
+    """
+    total = len(frame)
+    if per_page is None:
+        return frame, {'total': total, 'page': 1, 'per_page': None, 'pages': 1}
+    pages = max(1, math.ceil(total / per_page))
+    start = (page - 1) * per_page
+    return frame.iloc[start:start + per_page], {'total': total, 'page': page, 'per_page': per_page, 'pages': pages}
+
+
+def _plain_date(value):
+    # Dates left in object columns (e.g. an END DATE column with a text cell)
+    if isinstance(value, datetime.date) and not pd.isna(value):
+        return value.strftime('%Y-%m-%d')
+    return value
+
+
+def _plain_frame(frame):
+    # Dates as YYYY-MM-DD strings and missing values as None
+    frame = frame.copy()
+    for column in frame.columns:
+        if pd.api.types.is_datetime64_any_dtype(frame[column]):
+            frame[column] = frame[column].dt.strftime('%Y-%m-%d')
+        elif frame[column].dtype == object:
+            frame[column] = frame[column].map(_plain_date)
+    values = frame.to_numpy(dtype=object)
+    values[pd.isna(values)] = None
+    return values
+
+
+def json_rows(frame):
+    """
+    The frame as a list of {column: value} dicts of JSON types.
+    """
+    columns = [str(column) for column in frame.columns]
+    rows = []
+    for row in _plain_frame(frame):
+        rows.append({
+            column: value.item() if isinstance(value, np.generic) else value
+            for column, value in zip(columns, row)
+        })
+    return rows
+
+
+def _display_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, (float, np.floating)):
+        return str(int(value)) if float(value).is_integer() else f'{value:.2f}'
+    return str(value)
+
+
+def display_rows(frame):
+    """
+    The frame as lists of strings for an HTML table: whole numbers without
+    decimals, other numbers to two places, blanks for missing values.
+    """
+    return [[_display_value(value) for value in row] for row in _plain_frame(frame)]
+
+
+def report_payload(job_id, summary, sheets, query):
+    """
+    The JSON document for the report of job `job_id`.
+    """
+    payload = dict(summary, job_id=job_id, filters={
+        'departments': query['departments'],
+        'horizons': query['horizons'],
+        'irc': query['irc'],
+    }, sheets=[])
+    for sheet in select_sheets(sheets, query):
+        rows, page_info = paginate(sheet['frame'], query['page'], query['per_page'])
+        payload['sheets'].append(dict(
+            page_info,
+            name=sheet['name'],
+            kind=sheet['kind'],
+            weeks=sheet['weeks'],
+            columns=[str(column) for column in sheet['frame'].columns],
+            rows=json_rows(rows),
+        ))
+    return payload
@@ -0,0 +1,139 @@
+import time
+
+import pandas as pd
+
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Alignment, Border, Font, PatternFill, Side
+from openpyxl.utils import get_column_letter
+
+# Fill used for the blank rows that separate departments
+BLACK_FILL = PatternFill(fill_type='solid', fgColor='000000')
+
+# Same look as the header row pandas writes with to_excel
+_THIN = Side(style='thin')
+HEADER_FONT = Font(bold=True)
+HEADER_BORDER = Border(left=_THIN, right=_THIN, top=_THIN, bottom=_THIN)
+HEADER_ALIGNMENT = Alignment(horizontal='center', vertical='top')
+
+
+def column_widths(df):
+    """
+    Returns one Excel column width per column of df: the longest rendered
+    value (header included) plus 2, computed with vectorized string ops.
+    """
+    widths = []
+    for col in df.columns:
+        series = df[col]
+        if pd.api.types.is_datetime64_any_dtype(series):
+            # str(datetime) is always 'YYYY-MM-DD HH:MM:SS'
+            lengths = pd.Series(19, index=series.index).where(series.notna(), 0)
+        else:
+            lengths = series.astype(str).str.len().where(series.notna(), 0)
+        longest = max(len(str(col)), int(lengths.max()) if len(lengths) else 0)
+        widths.append(longest + 2)
+    return widths
+
+
+class OpenpyxlReportWriter:
+    """
+    Classic backend: pandas ExcelWriter on a regular openpyxl workbook.
+    The whole workbook stays in memory until close().
+    """
+
+    def __init__(self, target):
+        self._writer = pd.ExcelWriter(target, engine='openpyxl')
+
+    def write_sheet(self, df, sheet_name, widths, separator_positions=()):
+        df.to_excel(self._writer, sheet_name=sheet_name, index=False)
+        worksheet = self._writer.sheets[sheet_name]
+
+        # Colour the separator rows directly (row 1 is the header)
+        n_cols = len(df.columns)
+        for position in list(separator_positions):
+            for cell in worksheet[int(position) + 2][:n_cols]:
+                cell.fill = BLACK_FILL
+
+        for idx, width in enumerate(widths, start=1):
+            worksheet.column_dimensions[get_column_letter(idx)].width = width
+
+    def close(self):
+        self._writer.close()
+
+
+class StreamingReportWriter:
+    """
+    Streaming backend: openpyxl write_only workbook. Rows are serialized as
+    they are appended, so memory does not grow with the number of cells.
+    """
+
+    def __init__(self, target):
+        self._target = target
+        self._workbook = Workbook(write_only=True)
+
+    def write_sheet(self, df, sheet_name, widths, separator_positions=()):
+        worksheet = self._workbook.create_sheet(title=sheet_name)
+
+        # Column widths must be set before the first row is written
+        for idx, width in enumerate(widths, start=1):
+            worksheet.column_dimensions[get_column_letter(idx)].width = width
+
+        header = []
+        for col in df.columns:
+            cell = WriteOnlyCell(worksheet, value=str(col))
+            cell.font = HEADER_FONT
+            cell.border = HEADER_BORDER
+            cell.alignment = HEADER_ALIGNMENT
+            header.append(cell)
+        worksheet.append(header)
+
+        separator_row = []
+        for _ in df.columns:
+            cell = WriteOnlyCell(worksheet, value=None)
+            cell.fill = BLACK_FILL
+            separator_row.append(cell)
+
+        # NaN / NaT become empty cells, everything else is written as-is
+        values = df.astype(object).where(df.notna(), None).to_numpy().tolist()
+        separators = set(int(p) for p in separator_positions)
+        for position, row in enumerate(values):
+            if position in separators:
+                worksheet.append(separator_row)
+            else:
+                worksheet.append(row)
+
+    def close(self):
+        self._workbook.save(self._target)
+
+
+WRITER_BACKENDS = {
+    'openpyxl': OpenpyxlReportWriter,
+    'streaming': StreamingReportWriter,
+}
+
+
+class ReportWriter:
+    """
+    Context manager that opens the requested backend for `target`.
+    autofit_seconds accumulates the time spent sizing columns.
+    """
+
+    def __init__(self, target, backend='streaming'):
+        if backend not in WRITER_BACKENDS:
+            raise ValueError(f"Unknown writer backend '{backend}'. Choose from: {', '.join(WRITER_BACKENDS)}")
+        self._backend = WRITER_BACKENDS[backend](target)
+        self.autofit_seconds = 0.0
+
+    def write_sheet(self, df, sheet_name, separator_positions=()):
+        started = time.perf_counter()
+        widths = column_widths(df)
+        self.autofit_seconds += time.perf_counter() - started
+        self._backend.write_sheet(df, sheet_name, widths, separator_positions)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self._backend.close()
+        return False
@@ -0,0 +1,156 @@
+import json
+import os
+import re
+
+import numpy as np
+import pandas as pd
+
+from forecast import DEFAULT_HALFLIFE_DAYS, DEFAULT_TREND_WINDOW_DAYS, FORECAST_METHODS
+
+DEFAULT_RULES_FILE = os.environ.get(
+    'ORDERGEN_RULES', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'rules.json')
+)
+
+# Rule names in the order they are applied; a row dropped by an earlier rule
+# is not counted again by a later one.
+FILTER_RULES = ['ignore_list', 'departments_to_ignore', 'desc_strings_to_ignore', 'stock_code_strings_to_ignore']
+
+
+def match_unique(series, predicate, dtype=bool):
+    """
+    Evaluates `predicate` once per distinct value of `series` and broadcasts
+    the result back to every row through the category codes. `predicate`
+    receives a pandas Index of strings and returns booleans (or values of
+    `dtype`). Missing values are matched as the string 'nan', as astype(str)
+    would render them.
+    """
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        codes = series.cat.codes.to_numpy()
+        uniques = series.cat.categories
+    else:
+        codes, uniques = pd.factorize(series)
+
+    labels = pd.Index(uniques).astype(str).append(pd.Index(['nan']))
+    hits = np.asarray(predicate(labels), dtype=dtype)
+    # Code -1 (missing) picks the trailing 'nan' entry
+    return hits[codes]
+
+
+class SalesRules:
+    """
+    Compiled filtering and department rules. Build one with compile_rules.
+    """
+
+    def __init__(self, departments_to_ignore, desc_strings_to_ignore, stock_code_strings_to_ignore,
+                 special_departments, forecast=None):
+        self.departments_to_ignore = list(departments_to_ignore)
+        self.desc_strings_to_ignore = list(desc_strings_to_ignore)
+        self.stock_code_strings_to_ignore = list(stock_code_strings_to_ignore)
+        self.special_departments = list(special_departments)
+
+        # Forecast method per department (see forecast.py)
+        forecast = forecast or {}
+        self.forecast_default = forecast.get('default_method', 'flat')
+        self.forecast_special = forecast.get('special_departments_method', self.forecast_default)
+        self.forecast_departments = dict(forecast.get('department_methods', {}))
+        self.forecast_halflife_days = forecast.get('halflife_days', DEFAULT_HALFLIFE_DAYS)
+        self.forecast_trend_window_days = forecast.get('trend_window_days', DEFAULT_TREND_WINDOW_DAYS)
+        methods = {self.forecast_default, self.forecast_special, *self.forecast_departments.values()}
+        unknown = methods - set(FORECAST_METHODS)
+        if unknown:
+            raise ValueError(f"Unknown forecast method(s) in rules: {', '.join(sorted(unknown))}. "
+                             f"Choose from: {', '.join(FORECAST_METHODS)}")
+
+        # Create lowercase versions / patterns for case-insensitive matching
+        self._departments_lower = [d.lower() for d in self.departments_to_ignore]
+        self._special_lower = [d.lower() for d in self.special_departments]
+        self._forecast_lower = {d.lower(): method for d, method in self.forecast_departments.items()}
+        self._desc_pattern = self._substring_pattern(self.desc_strings_to_ignore)
+        self._code_pattern = self._substring_pattern(self.stock_code_strings_to_ignore)
+
+    @staticmethod
+    def _substring_pattern(strings):
+        if not strings:
+            return None
+        return re.compile('|'.join(re.escape(s) for s in strings), re.IGNORECASE)
+
+    @staticmethod
+    def _contains(labels, pattern):
+        if pattern is None:
+            return np.zeros(len(labels), dtype=bool)
+        return labels.str.contains(pattern)
+
+    def is_special(self, departments):
+        """
+        Boolean array: True where the department gets the special 1-week rule.
+        """
+        return match_unique(departments, lambda labels: labels.str.lower().isin(self._special_lower))
+
+    def forecast_methods(self, departments):
+        """
+        Array of forecast method names, one per row of `departments`: the
+        department's own method if listed, else the special-departments
+        method for special departments, else the default.
+        """
+        def methods_for(labels):
+            lower = labels.str.lower()
+            methods = np.where(lower.isin(self._special_lower), self.forecast_special, self.forecast_default)
+            return [self._forecast_lower.get(d, m) for d, m in zip(lower, methods.tolist())]
+
+        return match_unique(departments, methods_for, dtype=object)
+
+    def sales_mask(self, df_sales, ignore_codes=()):
+        """
+        Evaluates every exclusion rule in one pass. Returns (keep, dropped)
+        where keep is a boolean array of rows to keep and dropped maps each
+        rule in FILTER_RULES to the number of rows it removed.
+        """
+        ignore_codes = set(ignore_codes)
+        rule_masks = [
+            ('ignore_list', match_unique(df_sales['Stock Code'], lambda labels: labels.isin(ignore_codes))
+             if ignore_codes else np.zeros(len(df_sales), dtype=bool)),
+            ('departments_to_ignore', match_unique(
+                df_sales['Description'], lambda labels: labels.str.lower().isin(self._departments_lower))),
+            ('desc_strings_to_ignore', match_unique(
+                df_sales['Stock Description'], lambda labels: self._contains(labels, self._desc_pattern))),
+            ('stock_code_strings_to_ignore', match_unique(
+                df_sales['Stock Code'], lambda labels: self._contains(labels, self._code_pattern))),
+        ]
+
+        drop = np.zeros(len(df_sales), dtype=bool)
+        dropped = {}
+        for name, mask in rule_masks:
+            dropped[name] = int((mask & ~drop).sum())
+            drop |= mask
+        return ~drop, dropped
+
+
+def compile_rules(rules):
+    """
+    Builds SalesRules from a dict with the keys used in rules.json.
+    """
+    return SalesRules(
+        departments_to_ignore=rules.get('departments_to_ignore', []),
+        desc_strings_to_ignore=rules.get('desc_strings_to_ignore', []),
+        stock_code_strings_to_ignore=rules.get('stock_code_strings_to_ignore', []),
+        special_departments=rules.get('special_departments', []),
+        forecast=rules.get('forecast'),
+    )
+
+
+def load_rules(rules_file=DEFAULT_RULES_FILE):
+    with open(rules_file) as fh:
+        return compile_rules(json.load(fh))
+
+
+_default_rules = None
+
+
+def default_rules():
+    """
+    SalesRules compiled from rules.json (or the file named by ORDERGEN_RULES).
+    """
+    global _default_rules
+    if _default_rules is None:
+        _default_rules = load_rules()
+    return _default_rules
@@ -0,0 +1,77 @@
+import os
+
+import pandas as pd
+
+from input_cache import read_frame, store_key, write_frame
+
+# A rollup has the same columns as read_sales_file's output, with one row per
+# SKU per day, so compute_reorder can use it in place of the raw sales detail.
+ROLLUP_KEYS = ['Stock Code', 'Stock Description', 'Description', 'Stock Date']
+ROLLUP_COLUMNS = ['Stock Date', 'Stock Code', 'Stock Description', 'Description', 'Quantity']
+
+DEFAULT_ROLLUP_DIR = os.environ.get('ORDERGEN_ROLLUP_DIR', os.path.expanduser('~/.local/share/ordergen/rollups'))
+
+
+def rollup_sales(df_sales):
+    """
+    Collapses sales line items into per-SKU per-day totals.
+    """
+    df = df_sales[ROLLUP_COLUMNS].copy()
+    df['Stock Date'] = pd.to_datetime(df['Stock Date']).dt.normalize()
+    # Same text conversion compute_reorder applies before grouping
+    for col in ('Stock Code', 'Stock Description', 'Description'):
+        if not isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = df[col].astype(str)
+    rollup = df.groupby(ROLLUP_KEYS, sort=False, dropna=False, observed=True)['Quantity'].sum().reset_index()
+    return rollup[ROLLUP_COLUMNS]
+
+
+def trailing_window(df_sales, trailing_days):
+    """
+    Keeps the last `trailing_days` calendar days of sales, counting back
+    from the latest sale. None keeps everything.
+    """
+    if not trailing_days:
+        return df_sales
+    dates = pd.to_datetime(df_sales['Stock Date'])
+    start = dates.max().normalize() - pd.Timedelta(days=trailing_days - 1)
+    return df_sales[dates >= start]
+
+
+class SalesRollupStore:
+    """
+    Persisted per-SKU per-day sales totals for one store. New sales exports
+    are merged in incrementally: the days an export covers replace whatever
+    the store held for those days, so re-uploading overlapping date ranges
+    never double counts.
+    """
+
+    def __init__(self, store_name, root_dir=DEFAULT_ROLLUP_DIR):
+        self.store_name = store_name
+        self.root_dir = root_dir
+        self._stem = os.path.join(root_dir, f'sales-rollup-{store_key(store_name)}')
+        os.makedirs(root_dir, exist_ok=True)
+
+    def merge(self, df_sales):
+        """
+        Merges a new sales export (raw line items or an existing rollup) into
+        the store and returns the updated rollup.
+        """
+        delta = rollup_sales(df_sales)
+        existing, _ = read_frame(self._stem)
+
+        if existing is not None and not delta.empty:
+            # The export is authoritative for every day in its date range
+            first_day = delta['Stock Date'].min()
+            last_day = delta['Stock Date'].max()
+            covered = existing['Stock Date'].between(first_day, last_day)
+            existing = existing[~covered]
+            merged = pd.concat([existing, delta], ignore_index=True)
+        elif existing is not None:
+            merged = existing
+        else:
+            merged = delta
+
+        merged = merged.sort_values('Stock Date', kind='stable', ignore_index=True)
+        write_frame(self._stem, merged)
+        return merged
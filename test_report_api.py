@@ -0,0 +1,23 @@
+import json
+
+import numpy as np
+import pandas as pd
+from werkzeug.datastructures import MultiDict
+
+from report_api import display_rows, parse_report_query, report_payload
+
+
+def test_mixed_type_date_column_is_json_safe():
+    # One text cell keeps END DATE an object column of Timestamps
+    frame = pd.DataFrame({
+        'Department': ['A', 'A', 'B'],
+        'Stock Code': ['00123', '555', 'ABC'],
+        'END DATE': pd.Series([pd.Timestamp('2026-02-01 10:30'), 'TBC', np.nan], dtype=object),
+    })
+    sheets = [{'name': 'IRC', 'kind': 'irc', 'weeks': None, 'frame': frame}]
+
+    payload = report_payload('job', {}, sheets, parse_report_query(MultiDict()))
+    rows = json.loads(json.dumps(payload))['sheets'][0]['rows']
+
+    assert [row['END DATE'] for row in rows] == ['2026-02-01', 'TBC', None]
+    assert [row[2] for row in display_rows(frame)] == ['2026-02-01', 'TBC', '']
@@ -1,9 +1,119 @@
-from flask import Flask, render_template, request, send_file, redirect, url_for
+from flask import Flask, Request, g, jsonify, render_template, request, send_file, url_for
+import gzip
+import hashlib
+import io
+import json
 import os
+import shutil
 import tempfile
-from X import calculate_reorder_quantities
+import time
+from X import INPUT_EXTENSIONS, validate_input_header
+from history import OrderHistory
+from jobs import JobQueue, QueueFull, REPORT_NAME, make_job_dir
+from metrics import QUEUE_DEPTH, REGISTRY, REQUEST_DURATION, configure_logging
+from reference import REFERENCE_FILES, reference_path
+from report_api import DEFAULT_PAGE_SIZE, display_rows, paginate, parse_report_query, report_payload, select_sheets
+
+# Upload limits: the whole request, and each file within it
+MAX_REQUEST_MB = int(os.environ.get("ORDERGEN_MAX_REQUEST_MB", "200"))
+MAX_FILE_MB = int(os.environ.get("ORDERGEN_MAX_FILE_MB", "100"))
+MAX_FILE_BYTES = MAX_FILE_MB * 1024 * 1024
+
+# Uploads up to this size stay in memory and are handed to the job as
+# bytes; larger ones spill to disk
+UPLOAD_SPOOL_BYTES = int(float(os.environ.get("ORDERGEN_UPLOAD_SPOOL_MB", "16")) * 1024 * 1024)
+
+# Store names key the order history used for DELTA sheets
+MAX_STORE_NAME = 100
+
+# Report views smaller than this are sent uncompressed
+GZIP_MIN_BYTES = int(os.environ.get("ORDERGEN_GZIP_MIN_BYTES", "1024"))
+
+# Form field, file name stem in the job directory, and header check. Left
+# empty, the inventory, ignore and IRC fields fall back to the reference
+# files in ORDERGEN_REFERENCE_DIR (see reference.py)
+UPLOADS = [
+    ("sales_file", "sales", "sales"),
+    ("inventory_file", "inventory", "inventory"),
+    ("ignore_file", "ignore", "ignore"),
+    ("irc_file", "IRC", "irc"),
+]
+
+
+class SpooledRequest(Request):
+    """
+    Buffers each uploaded file in a SpooledTemporaryFile, so small uploads
+    never touch the disk.
+    """
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_BYTES)
+
 
 app = Flask(__name__)
+app.request_class = SpooledRequest
+app.config["MAX_CONTENT_LENGTH"] = MAX_REQUEST_MB * 1024 * 1024
+configure_logging()
+
+# Reports are generated on a bounded background process pool
+job_queue = JobQueue()
+QUEUE_DEPTH.set_function(job_queue.pending)
+
+
+@app.before_request
+def start_timer():
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+def record_request_duration(response):
+    started = g.pop("request_started", None)
+    if started is not None:
+        REQUEST_DURATION.observe(
+            time.perf_counter() - started,
+            method=request.method,
+            endpoint=request.endpoint or "unknown",
+            status=response.status_code,
+        )
+    return response
+
+
+def upload_path(tmpdir, stem, upload):
+    """
+    Where to save an uploaded file. The upload's extension is kept when it
+    is a known input format so the readers can tell CSV, Parquet and Excel
+    apart; anything else is saved without one and sniffed from its contents.
+    """
+    extension = os.path.splitext(upload.filename)[1].lower()
+    return os.path.join(tmpdir, stem + (extension if extension in INPUT_EXTENSIONS else ""))
+
+
+def upload_size(upload):
+    stream = upload.stream
+    stream.seek(0, os.SEEK_END)
+    size = stream.tell()
+    stream.seek(0)
+    return size
+
+
+def stage_upload(tmpdir, stem, upload, size):
+    """
+    What the job reads for an upload: files up to the spool size are handed
+    over in memory, larger ones are written to the job directory and passed
+    by path.
+    """
+    if size <= UPLOAD_SPOOL_BYTES:
+        upload.stream.seek(0)
+        return io.BytesIO(upload.stream.read())
+    path = upload_path(tmpdir, stem, upload)
+    upload.save(path)
+    return path
+
+
+@app.errorhandler(413)
+def request_too_large(error):
+    return jsonify(error=f"Upload is larger than the {MAX_REQUEST_MB} MB limit per request."), 413
+
 
 @app.route("/", methods=["GET", "POST"])
 def index():
@@ -11,70 +121,229 @@ def index():
         return render_template("index.html")
 
     # POST: files uploaded
-    # Create a temp folder for this run
-    tmpdir = tempfile.mkdtemp()
-    sales_path = os.path.join(tmpdir, "sales.xlsx")
-    inventory_path = os.path.join(tmpdir, "inventory.xlsx")
-    ignore_path = os.path.join(tmpdir, "ignore.xlsx")
-    irc_path = os.path.join(tmpdir, "IRC.xlsx")
-
-    # Save required file: sales
     sales_file = request.files.get("sales_file")
     if not sales_file or sales_file.filename == "":
         return "Sales file is required", 400
-    sales_file.save(sales_path)
-
-    # Optional files
-    inventory_file = request.files.get("inventory_file")
-    if inventory_file and inventory_file.filename != "":
-        inventory_file.save(inventory_path)
-    else:
-        inventory_path = "inventory.xlsx"  # will trigger your file-not-found logic if used
-
-    ignore_file = request.files.get("ignore_file")
-    if ignore_file and ignore_file.filename != "":
-        ignore_file.save(ignore_path)
-    else:
-        ignore_path = "ignore.xlsx"
-
-    irc_file = request.files.get("irc_file")
-    if irc_file and irc_file.filename != "":
-        irc_file.save(irc_path)
-    else:
-        irc_path = "IRC.xlsx"
-
-    # Run your logic – auto_export=True skips the prompt and always generates the report
-    cwd = os.getcwd()
+
+    store = request.form.get("store", "").strip()
+    if len(store) > MAX_STORE_NAME:
+        return jsonify(error=f"Store name can be at most {MAX_STORE_NAME} characters."), 400
+    history = None
+    if store:
+        # Runs for a named store are recorded so the next one gets a DELTA sheet
+        try:
+            history = OrderHistory(store)
+        except ValueError as e:
+            return jsonify(error=str(e)), 400
+
+    # Reject oversized files and files without the expected columns before
+    # anything is queued; only the header row is read here
+    uploads = {}
+    for field, stem, kind in UPLOADS:
+        upload = request.files.get(field)
+        if not upload or upload.filename == "":
+            continue
+        size = upload_size(upload)
+        if size > MAX_FILE_BYTES:
+            return jsonify(error=f"{upload.filename} is larger than the {MAX_FILE_MB} MB limit per file."), 413
+        try:
+            validate_input_header(upload.stream, kind)
+        except ValueError as e:
+            return jsonify(error=f"{upload.filename}: {e}"), 400
+        uploads[field] = (stem, upload, size)
+
+    # Create a temp folder for this run (removed when the job ends)
+    tmpdir = make_job_dir()
+    inputs = {}
+    for field, _, kind in UPLOADS:
+        if field in uploads:
+            stem, upload, size = uploads[field]
+            inputs[field] = stage_upload(tmpdir, stem, upload, size)
+        elif kind in REFERENCE_FILES:
+            # Served from the job processes' warm reference data; a missing
+            # file triggers the file-not-found logic
+            inputs[field] = reference_path(kind)
+    if history is not None:
+        inputs["history"] = history
+
     try:
-        # run function with the paths we just saved
-        calculate_reorder_quantities(
-            sales_file=sales_path,
-            inventory_file=inventory_path,
-            ignore_file=ignore_path,
-            irc_file=irc_path,
-            auto_export=True,
-        )
+        job_id = job_queue.submit(tmpdir, inputs, profile=request.args.get("profile") == "1")
+    except QueueFull as e:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+        return jsonify(error=str(e)), 503, {"Retry-After": "10"}
+
+    return jsonify(
+        job_id=job_id,
+        status_url=url_for("job_status", job_id=job_id),
+    ), 202
+
+
+@app.route("/jobs/<job_id>")
+def job_status(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify(error="Unknown job"), 404
+
+    info = job_queue.status(job)
+    if info["state"] == "done":
+        info["download_url"] = url_for("job_download", job_id=job_id)
+        info["report_url"] = url_for("job_report_html", job_id=job_id)
+        info["json_url"] = url_for("job_report_json", job_id=job_id)
+        if any(sheet["kind"] == "delta" for sheet in job_queue.views(job)[1]):
+            info["delta_url"] = url_for("job_delta_json", job_id=job_id)
+    return jsonify(info)
+
+
+@app.route("/jobs/<job_id>/download")
+def job_download(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        return "Unknown job", 404
+
+    report = job_queue.report(job)
+    if report is None:
+        return "Report is not ready.", 409
+
+    # Stream the in-memory workbook to the browser
+    return send_file(
+        report,
+        mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        as_attachment=True,
+        download_name=REPORT_NAME
+    )
+
+
+def finished_views(job_id):
+    """
+    (job, summary, sheets) for a finished job, or an error response.
+    """
+    job = job_queue.get(job_id)
+    if job is None:
+        return None, jsonify(error="Unknown job"), 404
+    views = job_queue.views(job)
+    if views is None:
+        return None, jsonify(error="Report is not ready."), 409
+    return (job,) + views, None, None
+
+
+def view_etag(job, view):
+    # A job's report never changes, so the tag only depends on the job,
+    # the view and the query string
+    query = "&".join(f"{key}={value}" for key, value in sorted(request.args.items(multi=True)))
+    return hashlib.sha1(f"{job.id}|{view}|{query}".encode()).hexdigest()
+
+
+def view_response(body, mimetype, etag):
+    """
+    Sends a report view gzip-compressed when the client accepts it. The
+    ETag is weak so it matches both encodings of the same view.
+    """
+    response = app.response_class(body, mimetype=mimetype)
+    if len(body) >= GZIP_MIN_BYTES and request.accept_encodings["gzip"]:
+        response.set_data(gzip.compress(body, compresslevel=6))
+        response.headers["Content-Encoding"] = "gzip"
+    return with_cache_headers(response, etag)
+
+
+def with_cache_headers(response, etag):
+    response.set_etag(etag, weak=True)
+    response.headers["Cache-Control"] = "private, no-cache"
+    response.vary.add("Accept-Encoding")
+    return response
+
+
+@app.route("/jobs/<job_id>/report.json")
+def job_report_json(job_id):
+    views, error, status = finished_views(job_id)
+    if views is None:
+        return error, status
+    job, summary, sheets = views
+
+    etag = view_etag(job, "json")
+    if request.if_none_match.contains_weak(etag):
+        return with_cache_headers(app.response_class(status=304), etag)
+    try:
+        query = parse_report_query(request.args)
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+
+    body = json.dumps(report_payload(job.id, summary, sheets, query), separators=(",", ":")).encode()
+    return view_response(body, "application/json", etag)
+
+
+@app.route("/jobs/<job_id>/delta.json")
+def job_delta_json(job_id):
+    views, error, status = finished_views(job_id)
+    if views is None:
+        return error, status
+    job, summary, sheets = views
+
+    delta = [sheet for sheet in sheets if sheet["kind"] == "delta"]
+    if not delta:
+        return jsonify(error="This run has no delta: no store was given, or it is the store's first run."), 404
+    etag = view_etag(job, "delta")
+    if request.if_none_match.contains_weak(etag):
+        return with_cache_headers(app.response_class(status=304), etag)
+    try:
+        query = parse_report_query(request.args)
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+
+    body = json.dumps(report_payload(job.id, summary, delta, query), separators=(",", ":")).encode()
+    return view_response(body, "application/json", etag)
+
+
+@app.route("/jobs/<job_id>/report")
+def job_report_html(job_id):
+    views, error, status = finished_views(job_id)
+    if views is None:
+        return error, status
+    job, summary, sheets = views
+
+    etag = view_etag(job, "html")
+    if request.if_none_match.contains_weak(etag):
+        return with_cache_headers(app.response_class(status=304), etag)
+    try:
+        query = parse_report_query(request.args, DEFAULT_PAGE_SIZE)
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+
+    def link(**changes):
+        args = request.args.to_dict(flat=False)
+        args.update({key: value for key, value in changes.items() if value is not None})
+        return url_for("job_report_html", job_id=job.id, **args)
+
+    # One sheet per page view; the others are tabs
+    selected = select_sheets(sheets, query)
+    current = next((sheet for sheet in selected if sheet["name"] == request.args.get("sheet")),
+                   selected[0] if selected else None)
+    rows, page_info = paginate(current["frame"], query["page"], query["per_page"]) if current else (None, None)
+    departments = sorted({str(value) for sheet in sheets for value in sheet["frame"]["Department"].dropna()})
+
+    body = render_template(
+        "report.html",
+        job_id=job.id,
+        summary=summary,
+        query=query,
+        departments=departments,
+        tabs=[(sheet["name"], len(sheet["frame"]), link(sheet=sheet["name"], page="1"), sheet is current)
+              for sheet in selected],
+        sheet=current,
+        columns=[str(column) for column in current["frame"].columns] if current else [],
+        rows=display_rows(rows) if current else [],
+        page_info=page_info,
+        prev_url=link(page=str(page_info["page"] - 1)) if page_info and page_info["page"] > 1 else None,
+        next_url=link(page=str(page_info["page"] + 1)) if page_info and page_info["page"] < page_info["pages"] else None,
+        download_url=url_for("job_download", job_id=job.id),
+        json_url=url_for("job_report_json", job_id=job.id, **request.args.to_dict(flat=False)),
+    ).encode()
+    return view_response(body, "text/html", etag)
 
-        # Your script saves "reorder_report.xlsx" in current working dir.
-        # To keep everything inside tmpdir, we can look for it there OR just move it.
-        report_path = os.path.join(cwd, "reorder_report.xlsx")
-        if not os.path.exists(report_path):
-            # maybe it saved in tmpdir instead, fallback
-            report_path = os.path.join(tmpdir, "reorder_report.xlsx")
-
-        if not os.path.exists(report_path):
-            return "Could not find generated report.", 500
-
-        # Send file to browser
-        return send_file(
-            report_path,
-            as_attachment=True,
-            download_name="reorder_report.xlsx"
-        )
 
-    finally:
-        # you can choose to clean tmpdir after send_file if you want with shutil.rmtree
-        pass
+@app.route("/metrics")
+def metrics():
+    # Prometheus text exposition format
+    return REGISTRY.render(), 200, {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
 
 
 if __name__ == "__main__":